@@ -0,0 +1,135 @@
+"""Admission control for the messages players send to change a game.
+
+Every plan, vote, impulse and will runs glue and is broadcast to the players
+it affects, and every resync encodes a client's whole root state under the
+game lock. So each connection and each player draws from a token bucket,
+and only so many of these may wait on games at once. Anything over is
+rejected with a hint of when to try again, rather than queued without bound.
+"""
+
+import time
+
+# Bounds on the hint given when changes are shed for load, in seconds.
+MIN_RETRY = 0.25
+MAX_RETRY = 30
+
+
+class TokenBucket(object):
+    """Allows ``rate`` events a second, in bursts of up to ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def wait(self, now):
+        """Get how many seconds until a token is free, or 0 if one is."""
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Admission(object):
+    """Decides which changes are run and which are shed, across every game
+    served by a process.
+
+    A rate of 0 leaves connections or players unlimited, and a
+    ``max_pending`` of 0 leaves the number of waiting changes unbounded.
+    """
+
+    def __init__(self, rate=0, burst=0, player_rate=0, player_burst=0,
+                 max_pending=0):
+        self.rate = rate
+        self.burst = burst
+        self.player_rate = player_rate
+        self.player_burst = player_burst
+        self.max_pending = max_pending
+
+        self.pending = 0
+
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = 0
+        self.max_pending_seen = 0
+        self.wait_time = 0
+        self.max_wait_time = 0
+        self.run_time = 0
+        self.reported = None
+
+    def make_bucket(self):
+        if not self.rate:
+            return None
+        return TokenBucket(self.rate, self.burst)
+
+    def make_player_bucket(self):
+        if not self.player_rate:
+            return None
+        return TokenBucket(self.player_rate, self.player_burst)
+
+    def admit(self, *buckets):
+        """Admit a change drawing on ``buckets``, returning None if it may
+        run, or how many seconds to wait before trying again if not.
+
+        Every admitted change must be followed by a call to ``done``.
+        """
+        now = time.monotonic()
+        buckets = [bucket for bucket in buckets if bucket is not None]
+
+        retry = max([bucket.wait(now) for bucket in buckets], default=0)
+        if retry:
+            self.rate_limited += 1
+            return retry
+
+        if self.max_pending and self.pending >= self.max_pending:
+            self.shed += 1
+            return self.get_shed_retry()
+
+        for bucket in buckets:
+            bucket.take()
+
+        self.admitted += 1
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        return None
+
+    def get_shed_retry(self):
+        """Guess how long the changes already waiting will take."""
+        done = self.admitted - self.pending
+        mean = self.run_time / done if done else MIN_RETRY
+        return min(max(self.pending * mean, MIN_RETRY), MAX_RETRY)
+
+    def done(self, waited, ran):
+        self.pending -= 1
+        self.wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+        self.run_time += ran
+
+    def stats(self):
+        done = self.admitted - self.pending
+        return {
+            'admitted': self.admitted,
+            'rateLimited': self.rate_limited,
+            'shed': self.shed,
+            'pending': self.pending,
+            'maxPending': self.max_pending_seen,
+            'meanWaitMs': self.wait_time * 1000 / done if done else None,
+            'maxWaitMs': self.max_wait_time * 1000,
+            'meanRunMs': self.run_time * 1000 / done if done else None
+        }
+
+    def report(self):
+        """Get the stats if anything happened since they were last reported,
+        or None."""
+        seen = (self.admitted, self.rate_limited, self.shed)
+        if seen == self.reported or not any(seen):
+            return None
+        self.reported = seen
+        return self.stats()
@@ -915,6 +915,54 @@ class End extends React.Component {
     }
 }
 
+function unescapePointer(token) {
+    return token.replace(/~1/g, '/').replace(/~0/g, '~');
+}
+
+function applyOperation(node, op, tokens, value) {
+    if (tokens.length === 0) {
+        return value;
+    }
+
+    if (node === null || typeof node !== 'object') {
+        throw new Error('Patch path does not exist.');
+    }
+
+    let [token, ...rest] = tokens;
+
+    // Copy along the path, so that React sees which parts changed.
+    if (Array.isArray(node)) {
+        let copy = node.slice();
+        let i = token === '-' ? copy.length : parseInt(token, 10);
+
+        if (rest.length === 0 && op === 'add') {
+            copy.splice(i, 0, value);
+        } else if (rest.length === 0 && op === 'remove') {
+            copy.splice(i, 1);
+        } else {
+            copy[i] = applyOperation(copy[i], op, rest, value);
+        }
+        return copy;
+    }
+
+    let copy = Object.assign({}, node);
+    if (rest.length === 0 && op === 'remove') {
+        delete copy[token];
+    } else {
+        copy[token] = applyOperation(copy[token], op, rest, value);
+    }
+    return copy;
+}
+
+function applyPatch(doc, ops) {
+    for (let op of ops) {
+        doc = applyOperation(doc, op.op,
+                             op.path.split('/').slice(1).map(unescapePointer),
+                             op.value);
+    }
+    return doc;
+}
+
 class Client {
     constructor() {
         this.onRootMessage = () => {};
@@ -942,7 +990,13 @@ class Client {
         this.id = jwtDecode(QS.token).t;
 
         this.seqNum = 0;
-        this.socket = new WebSocket('ws://' + window.location.host + '/ws?' +
+        this.version = 0;
+        this.doc = {};
+        this.resyncing = false;
+        // The socket lives next to the page, which may be under /g/<game>/.
+        var base = window.location.pathname.replace(/[^/]*$/, '');
+        this.socket = new WebSocket('ws://' + window.location.host + base +
+                                    'ws?' +
                                     querystring.stringify({token: QS.token}));
 
         this.socket.onopen = () => {
@@ -962,10 +1016,23 @@ class Client {
 
             switch (payload.type) {
                 case 'root':
+                    this.version = payload.version;
+                    this.doc = Object.assign({}, this.doc, body);
+                    this.resyncing = false;
                     this.onRootMessage(body);
                     break;
 
+                case 'patch':
+                    this.onPatchMessage(payload.version, body);
+                    break;
+
                 case 'pend':
+                    this.version = payload.version;
+                    this.doc = Object.assign({}, this.doc, {
+                        publicState: body.publicState,
+                        playerState: body.playerState,
+                        phaseState: body.phaseState
+                    });
                     this.onPhaseEndMessage(body);
                     break;
 
@@ -975,7 +1042,7 @@ class Client {
                     break;
 
                 case 'rej':
-                    this.promises[body].reject();
+                    this.promises[body].reject(payload.retry);
                     delete this.promises[body];
                     break;
 
@@ -1003,6 +1070,36 @@ class Client {
         };
     }
 
+    onPatchMessage(version, ops) {
+        if (this.resyncing) {
+            return;
+        }
+
+        let doc;
+        try {
+            if (version !== this.version + 1) {
+                throw new Error('Missed a patch.');
+            }
+            doc = applyPatch(this.doc, ops);
+        } catch (e) {
+            console.error('Could not apply patch, resyncing:', e);
+            this.resyncing = true;
+            this.request('resync', null).catch(() => {});
+            return;
+        }
+
+        let changed = {};
+        for (let key of Object.keys(doc)) {
+            if (doc[key] !== this.doc[key]) {
+                changed[key] = doc[key];
+            }
+        }
+
+        this.version = version;
+        this.doc = doc;
+        this.onRootMessage(changed);
+    }
+
     send(type, body) {
         let n = this.seqNum;
         this.socket.send(JSON.stringify({
@@ -1015,9 +1112,22 @@ class Client {
     }
 
     request(type, body) {
-        let n = this.send(type, body);
         return new Promise((resolve, reject) => {
-            this.promises[n] = {resolve: resolve, reject: reject};
+            let attempt = () => {
+                let n = this.send(type, body);
+                this.promises[n] = {
+                    resolve: resolve,
+                    reject: (retry) => {
+                        // The server was too busy, and said when to try again.
+                        if (retry === undefined) {
+                            reject();
+                        } else {
+                            setTimeout(attempt, retry * 1000);
+                        }
+                    }
+                };
+            };
+            attempt();
         });
     }
 }
@@ -1065,8 +1175,9 @@ class Root extends React.Component {
     componentDidMount() {
         this.client.onRootMessage = root => {
             let lastLocale = this.state.locale;
+            let publicInfo = root.publicInfo || this.state.publicInfo;
             this.setState(root);
-            let locale = QS.lang || (root.publicInfo ? root.publicInfo.locale : null) || navigator.language;
+            let locale = QS.lang || (publicInfo ? publicInfo.locale : null) || navigator.language;
 
             // If our locale changed, we need to load new locale messages.
             if (!this.state.ready || locale !== lastLocale) {
@@ -0,0 +1,68 @@
+"""Micro-benchmarks for the glue wire formats.
+
+Run against a game directory to time decoding and encoding of its state,
+plan, ballot and action files in every available format::
+
+    python -m padrino.bench <game path>
+"""
+
+import argparse
+import glob
+import os
+import timeit
+import yaml
+
+from padrino import codec
+
+
+def pure_yaml_format():
+    class PureYAMLFormat(codec.Format):
+        def dumps(self, data):
+            return yaml.dump(data, Dumper=yaml.SafeDumper).encode('utf-8')
+
+        def loads(self, raw):
+            return yaml.load(raw, Loader=yaml.SafeLoader)
+
+    return PureYAMLFormat('yaml (pure)')
+
+
+def time_format(format, data, number):
+    raw = format.dumps(data)
+    dumps = min(timeit.repeat(lambda: format.dumps(data), number=number,
+                              repeat=3)) / number
+    loads = min(timeit.repeat(lambda: format.loads(raw), number=number,
+                              repeat=3)) / number
+    return len(raw), loads, dumps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('game_path')
+    parser.add_argument('--number', type=int, default=20,
+                        help='iterations per measurement')
+    args = parser.parse_args()
+
+    formats = [pure_yaml_format()] + [codec.FORMATS[name]
+                                      for name in sorted(codec.FORMATS)]
+
+    print('%-24s %-12s %10s %12s %12s' % ('file', 'format', 'bytes',
+                                          'load (ms)', 'dump (ms)'))
+    for path in sorted(glob.glob(os.path.join(args.game_path, '*.yml*'))):
+        with open(path, 'r') as f:
+            data = codec.load_yaml(f)
+
+        for format in formats:
+            try:
+                size, loads, dumps = time_format(format, data, args.number)
+            except (TypeError, ValueError):
+                # e.g. the binary secret in meta.yml has no JSON encoding.
+                print('%-24s %-12s %10s' % (os.path.basename(path),
+                                            format.name, 'n/a'))
+                continue
+            print('%-24s %-12s %10d %12.3f %12.3f' % (
+                os.path.basename(path), format.name, size, loads * 1000,
+                dumps * 1000))
+
+
+if __name__ == '__main__':
+    main()
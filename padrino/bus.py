@@ -0,0 +1,108 @@
+"""A local message bus between server processes, over a Unix socket.
+
+Each message is a small JSON header and an opaque payload. Payloads are
+passed along untouched, so websocket frames encoded by one process can be
+written out by another without being decoded again.
+"""
+
+import json
+import socket
+import struct
+
+import tornado.ioloop
+import tornado.iostream
+import tornado.tcpserver
+
+_HEADER = struct.Struct('>II')
+
+
+class Peer(object):
+    """One end of a bus connection.
+
+    Messages are passed to ``on_message`` as ``(peer, header, payload)``.
+    """
+
+    def __init__(self, stream, on_message):
+        self.stream = stream
+        self.on_message = on_message
+
+        # Frames waiting to go out at the end of this loop iteration, as
+        # [payload, [connection IDs]].
+        self.frames = []
+
+    def send(self, header, payload=b''):
+        self.flush_frames()
+        self.write(header, payload)
+
+    def send_frame(self, conn, frame):
+        """Send a frame for a connection on the other end.
+
+        Consecutive sends of the same frame are coalesced into one message.
+        """
+        if self.frames and self.frames[-1][0] is frame:
+            self.frames[-1][1].append(conn)
+            return
+
+        if not self.frames:
+            tornado.ioloop.IOLoop.current().add_callback(self.flush_frames)
+        self.frames.append([frame, [conn]])
+
+    def flush_frames(self):
+        frames, self.frames = self.frames, []
+        for frame, conns in frames:
+            self.write({'op': 'frame', 'conns': conns}, frame)
+
+    def write(self, header, payload):
+        raw = json.dumps(header).encode('utf-8')
+        try:
+            self.stream.write(_HEADER.pack(len(raw), len(payload)) + raw)
+            if payload:
+                self.stream.write(payload)
+        except tornado.iostream.StreamClosedError:
+            pass
+
+    async def run(self):
+        """Read messages until the other end goes away."""
+        try:
+            while True:
+                header_len, payload_len = _HEADER.unpack(
+                    await self.stream.read_bytes(_HEADER.size))
+                header = json.loads(
+                    (await self.stream.read_bytes(header_len)).decode('utf-8'))
+                payload = await self.stream.read_bytes(payload_len) \
+                          if payload_len else b''
+                self.on_message(self, header, payload)
+        except tornado.iostream.StreamClosedError:
+            pass
+
+    def close(self):
+        self.stream.close()
+
+
+class Server(tornado.tcpserver.TCPServer):
+    """Accepts bus connections from other processes."""
+
+    def __init__(self, on_connect, on_message, on_disconnect):
+        super().__init__()
+        self.on_connect = on_connect
+        self.on_message = on_message
+        self.on_disconnect = on_disconnect
+
+        self.peers = set()
+
+    async def handle_stream(self, stream, address):
+        peer = Peer(stream, self.on_message)
+        self.peers.add(peer)
+        self.on_connect(peer)
+        try:
+            await peer.run()
+        finally:
+            self.peers.discard(peer)
+            self.on_disconnect(peer)
+
+
+async def connect(path, on_message):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stream = tornado.iostream.IOStream(sock)
+    await stream.connect(path)
+    return Peer(stream, on_message)
@@ -0,0 +1,88 @@
+import json
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def load_yaml(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump_yaml(data, stream=None, **kwargs):
+    return yaml.dump(data, stream, Dumper=SafeDumper, **kwargs)
+
+
+def _int_keys(pairs):
+    # Glue maps are keyed by player, action and turn IDs, which JSON can only
+    # carry as strings.
+    return {int(k) if k.lstrip('-').isdigit() else k: v for k, v in pairs}
+
+
+class Format(object):
+    def __init__(self, name):
+        self.name = name
+
+    def dumps(self, data):
+        raise NotImplementedError
+
+    def loads(self, raw):
+        raise NotImplementedError
+
+    def load(self, stream):
+        return self.loads(stream.read())
+
+
+class YAMLFormat(Format):
+    def dumps(self, data):
+        return dump_yaml(data).encode('utf-8')
+
+    def loads(self, raw):
+        return load_yaml(raw)
+
+    def load(self, stream):
+        return load_yaml(stream)
+
+
+class JSONFormat(Format):
+    def dumps(self, data):
+        return json.dumps(data).encode('utf-8')
+
+    def loads(self, raw):
+        return json.loads(raw.decode('utf-8'), object_pairs_hook=_int_keys)
+
+
+class MsgpackFormat(Format):
+    def dumps(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, raw):
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+    def load(self, stream):
+        for data in msgpack.Unpacker(stream, raw=False, strict_map_key=False):
+            return data
+        return None
+
+
+FORMATS = {
+    'yaml': YAMLFormat('yaml'),
+    'json': JSONFormat('json'),
+}
+
+if msgpack is not None:
+    FORMATS['msgpack'] = MsgpackFormat('msgpack')
+
+
+def get_format(name):
+    try:
+        return FORMATS[name]
+    except KeyError:
+        raise ValueError('unknown or unavailable format: {}'.format(name))
@@ -1,163 +1,476 @@
+import asyncio
+import contextlib
 import datetime
-import functools
+import json
 import logging
 import os
 import jwt
 import pytz
-import shutil
+import threading
 import time
-import yaml
 
+from padrino import codec
 from padrino import glue
+from padrino import index
+from padrino import snapshots
+from padrino import storage
+from padrino import tokens
+from padrino import views
 
 logger = logging.getLogger(__name__)
 
+# How long changes to meta may sit in memory before being written out.
+SAVE_DELAY = 1.0
+
+# How each finished phase's part of the game log is stored.
+LOG_FORMAT = codec.get_format('json')
+
+
+async def run_in_executor(f, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, f, *args)
+
+
+class Profile(object):
+    """The time spent in each stage of something, such as loading a game."""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.monotonic() - start))
+
+    def report(self):
+        return ', '.join('{} {:.1f}ms'.format(name, elapsed * 1000)
+                         for name, elapsed in self.stages)
+
+
+class Change(object):
+    """A change to a game, published to its subscribers."""
+
+    __slots__ = ('version', 'kind', 'player_id')
+
+    # A plan was edited.
+    PLAN = 'plan'
+    # A vote was cast.
+    BALLOT = 'ballot'
+    # The game state changed mid-phase, e.g. by an impulse or modkill.
+    STATE = 'state'
+    # Meta changed, e.g. a will or the phase end.
+    META = 'meta'
+    # A phase ended.
+    PHASE = 'phase'
+
+    def __init__(self, version, kind, player_id=None):
+        self.version = version
+        self.kind = kind
+        # The player who made the change, if any.
+        self.player_id = player_id
+
 
 class Game(object):
-    def __init__(self, root):
+    def __init__(self, root, backend=None, profile=None):
         self.root = root
+        self.profile = profile if profile is not None else Profile()
 
         self.state_path = os.path.join(self.root, 'state.yml')
-        self.meta_path = os.path.join(self.root, 'meta.yml')
         self.actions_path = os.path.join(self.root, 'actions.yml')
 
         self.plan_path = os.path.join(self.root, 'plan.yml')
         self.ballot_path = os.path.join(self.root, 'ballot.yml')
 
-        self.load_state()
-        self.load_meta()
-        self.load_players()
+        # Meta, and per-phase copies of the state, plan, actions and ballot
+        # files.
+        with self.profile.stage('storage'):
+            self.storage = storage.open_storage(self.root, backend)
+        self.snapshots = self.storage.snapshots
+
+        # Glue views over the snapshots of finished phases never change, so
+        # they only need to be computed once. See ``run_snapshot_view``.
+        self.snapshot_cache = views.ViewCache(maxsize=1024)
+
+        # Views computed from finished phases, which never change. Views of
+        # the current phase are cached by subscribers instead, which drop
+        # them on every change. Result views are also kept in the snapshot
+        # store once built for every player, so they survive restarts.
+        self.views = views.ViewCache()
+        self.result_views_lock = threading.Lock()
+
+        # Held while snapshot files are written out and read by glue off the
+        # game lock, so that pruning can't remove them in between.
+        self.snapshot_files_lock = threading.RLock()
+
+        # The planned actions and log of finished phases, which only ever grow
+        # by a phase at a time.
+        self.game_planned = {}
+        self.game_log = {}
+        self.logged_phases = set()
+        self.game_log_lock = threading.Lock()
+
+        # See ``lock``.
+        self._lock = None
+
+        # Bumped on every change to the game, so views built from it can tell
+        # when they are stale.
+        self.version = 0
+        self.subscribers = []
+
+        # The in-memory meta is authoritative; storage is written behind it.
+        self.meta_generation = 0
+        self.saved_meta_generation = 0
+        self.written_meta_generation = 0
+        self.save_handle = None
+        self.write_lock = threading.Lock()
+
+        # The winners of the current state, if known.
+        self.winners = None
+        self.winners_stale = True
+
+        with self.profile.stage('state'):
+            self.load_state()
+        with self.profile.stage('meta'):
+            self.load_meta()
+        with self.profile.stage('view-players'):
+            self.load_players()
+
+    @property
+    def lock(self):
+        """Held by the server around each operation on the game, so that
+        awaiting glue never lets two mutations interleave.
+
+        Games may be loaded on executor threads, where an ``asyncio.Lock``
+        can't be made before Python 3.10, so it is made on first use instead.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def subscribe(self, f):
+        """Call ``f`` with a ``Change`` every time the game changes.
+
+        Subscribers are called from whichever thread made the change, while it
+        still holds the game lock.
+        """
+        self.subscribers.append(f)
+
+    def bump_version(self, kind, player_id=None):
+        self.version += 1
+
+        change = Change(self.version, kind, player_id)
+        for f in list(self.subscribers):
+            f(change)
 
     def load_state(self):
         with open(self.state_path, 'r') as f:
-            self.state = yaml.load(f)
+            state = codec.load_yaml(f)
+
+        if not isinstance(state, dict) or \
+           state.get('phase') not in ('Night', 'Day') or \
+           not isinstance(state.get('turn'), int):
+            raise ValueError('invalid state: {}'.format(self.state_path))
+
+        self.state = state
+        self.invalidate_winners()
 
     def load_meta(self):
-        with open(self.meta_path, 'r') as f:
-            self.meta = yaml.load(f)
+        self.meta = self.storage.load_meta()
+        self.index = index.Index(self.meta)
 
     def save_meta(self):
-        with open(self.meta_path, 'w') as f:
-            yaml.dump(self.meta, f, default_flow_style=False)
+        """Mark meta as changed.
+
+        On the IOLoop, changes are coalesced and written out after
+        ``SAVE_DELAY``. Elsewhere, or on ``flush()``, they are written at once.
+        """
+        self.meta_generation += 1
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+
+        if self.save_handle is None:
+            self.save_handle = loop.call_later(SAVE_DELAY, self.save_meta_later)
+
+    def save_meta_later(self):
+        self.save_handle = None
+        if self.saved_meta_generation == self.meta_generation:
+            return
+
+        # Serialize on the loop, so the write sees a consistent meta.
+        generation = self.meta_generation
+        raw = self.storage.dump_meta(self.meta)
+        self.saved_meta_generation = generation
+
+        asyncio.ensure_future(run_in_executor(self.write_meta, raw,
+                                              generation))
+
+    def flush(self):
+        if self.saved_meta_generation == self.meta_generation:
+            return
+
+        generation = self.meta_generation
+        raw = self.storage.dump_meta(self.meta)
+        self.saved_meta_generation = generation
+        self.write_meta(raw, generation)
+
+    def write_meta(self, raw, generation):
+        with self.write_lock:
+            # A newer meta may already have been written by a flush.
+            if generation < self.written_meta_generation:
+                return
+
+            self.storage.write_meta(raw)
+            self.written_meta_generation = generation
 
     def load_players(self):
-        self.players = glue.run('view-players', self.state_path)
+        self.set_players(glue.run('view-players', self.state_path))
+
+    async def load_players_async(self):
+        self.set_players(await glue.run_async('view-players',
+                                              self.state_path))
+
+    def set_players(self, players):
+        self.index.update_players(players)
+        self.players = players
+
+    def invalidate_winners(self):
+        # Once someone has won, the game is over for good.
+        if self.winners is None:
+            self.winners_stale = True
 
     def get_raw_winners(self):
-        return glue.run('view-winners', self.state_path)
+        if self.winners_stale:
+            self.winners = glue.run('view-winners', self.state_path)
+            self.winners_stale = False
+        return self.winners
+
+    async def get_raw_winners_async(self):
+        if self.winners_stale:
+            self.winners = await glue.run_async('view-winners',
+                                                self.state_path)
+            self.winners_stale = False
+        return self.winners
 
     def is_game_over(self):
         return self.get_raw_winners() is not None
 
+    async def is_game_over_async(self):
+        return await self.get_raw_winners_async() is not None
+
     def set_will_for(self, player_id, will):
         if self.players[player_id]['causeOfDeath'] is not None:
             raise ValueError('player is dead, cannot set will anymore')
         self.meta['players'][player_id]['will'] = will
+        self.bump_version(Change.META, player_id)
         self.save_meta()
 
     def get_will(self, player_id):
         return self.meta['players'][player_id]['will']
 
-    def get_phase_state(self, player_id):
-        winners = self.get_raw_winners()
+    async def get_phase_states_async(self, player_ids):
+        """Build the phase state for several players at once.
 
+        All players share a single batch of glue views, so the glue cost does
+        not grow with the number of players.
+        """
+        winners = await self.get_raw_winners_async()
         if winners is not None:
-            return {
-                'phase': 'End',
-                'winners': [self.meta['players'][player_id]['name']
-                            for player_id in winners],
-                'players': {
-                    self.meta['players'][player_id]['name']: {
-                        'fullRole': self.get_full_role(player_id),
-                    } for player_id, player in self.players.items()
-                },
-                'log': self.get_game_log(),
-                'planned': self.get_game_planned(),
-            }
+            # The game log walks the whole history, so build it off the loop.
+            await run_in_executor(self.get_game_log)
+            return self.build_end_phase_states(player_ids, winners)
+
+        return self.build_phase_states(
+            player_ids,
+            await glue.run_batch_async(self.get_phase_view_commands()))
+
+    def build_end_phase_states(self, player_ids, winners):
+        phase_state = {
+            'phase': 'End',
+            'winners': [self.index.player_names[player_id]
+                        for player_id in winners],
+            'players': {
+                self.index.player_names[player_id]: {
+                    'fullRole': self.get_full_role(player_id),
+                } for player_id, player in self.players.items()
+            },
+            'log': self.get_game_log(),
+            'planned': self.get_game_planned(),
+        }
+        return {player_id: phase_state for player_id in player_ids}
+
+    def get_phase_view_commands(self):
+        state_pre_path = self.get_snapshot_path(
+            'state', self.state['phase'].lower(), self.state['turn'])
 
         if self.state['phase'] == 'Night':
-            return {
-                'phase': 'Night',
-                'end': self.meta['schedule']['phase_end'],
-                'deaths': self.get_current_deaths_view(),
-                'plan': self.get_current_plan_view(player_id),
-            }
+            return [
+                ('view-plan', self.state_path, self.plan_path),
+                ('view-deaths', state_pre_path, self.state_path),
+            ]
 
         if self.state['phase'] == 'Day':
             # We need to get the plan in this way such that we can see actions
             # on their last use that are in the plan.
-            raw_plan = self.filter_raw_plan_view(
-                player_id,
-                glue.run('view-plan',
-                    self.state_path + '.day.' + str(self.state['turn']),
-                    self.plan_path))
-
-            return {
-                'phase': 'Day',
+            return [
+                ('view-plan', state_pre_path, self.plan_path),
+                ('view-deaths', state_pre_path, self.state_path),
+                ('view-messages', state_pre_path, self.state_path),
+            ]
+
+    def build_phase_states(self, player_ids, results):
+        if self.state['phase'] == 'Night':
+            raw_plan, raw_deaths = results
+            deaths = self.interpret_raw_deaths(raw_deaths)
+
+            return {player_id: {
+                'phase': 'Night',
                 'end': self.meta['schedule']['phase_end'],
-                'ballot': self.get_current_ballot(),
-                'deaths': self.get_current_deaths_view(),
-                'messages': self.get_current_messages_view(player_id, raw_plan),
-                'plan': self.interpret_raw_plan_view(raw_plan)
-            }
+                'deaths': deaths,
+                'plan': self.interpret_raw_plan_view(
+                    self.filter_raw_plan_view(player_id, raw_plan)),
+            } for player_id in player_ids}
+
+        if self.state['phase'] == 'Day':
+            raw_plan, raw_deaths, raw_messages = results
+            deaths = self.interpret_raw_deaths(raw_deaths)
+            ballot = self.get_current_ballot()
+
+            phase_states = {}
+            for player_id in player_ids:
+                raw = self.filter_raw_plan_view(player_id, raw_plan)
+                phase_states[player_id] = {
+                    'phase': 'Day',
+                    'end': self.meta['schedule']['phase_end'],
+                    'ballot': ballot,
+                    'deaths': deaths,
+                    'messages': self.interpret_messages(
+                        raw, raw_messages.get(player_id, [])),
+                    'plan': self.interpret_raw_plan_view(raw)
+                }
+            return phase_states
 
-    @functools.lru_cache(maxsize=None)
-    def get_game_history(self):
-        return {
-            turn: {
-                phase: [{
-                    'command': self.meta['actions'][act['action']]['command'],
-                    'source': self.meta['players'][act['source']]['name'],
-                    'targets': [self.meta['players'][target]['name']
-                                for target in act['targets']],
-                    'trace': act['trace'],
-                } for act in acts]
-                for phase, acts in phases.items()
-            } for turn, phases in glue.run('view-history',
-                                           self.state_path).items()}
-
-    @functools.lru_cache(maxsize=None)
     def get_final_plan_view(self, turn, phase):
+        return self.views.get(
+            ('final_plan', turn, phase),
+            lambda: self.build_final_plan_view(turn, phase))
+
+    def build_final_plan_view(self, turn, phase):
         return [{
-            'command': self.meta['actions'][info['action']]['command'],
-            'source': self.meta['players'][info['act']['source']]['name'],
+            'command': self.index.actions[info['action']].command,
+            'source': self.index.player_names[info['act']['source']],
             'targets': None if info['act'] is None else [
-                self.meta['players'][target]['name']
+                self.index.player_names[target]
                 for target in info['act']['targets']],
             'trace': info['act']['trace'],
         } for info in self.get_raw_plan_view(turn, phase)
           if info['act'] is not None]
 
     def get_game_planned(self):
-        planned = {
-            turn: {
-                'Day': self.get_final_plan_view(turn, 'day'),
-                'Night': self.get_final_plan_view(turn, 'night')
-            } for turn in range(1, self.state['turn'])}
-        if self.state['phase'] == 'Day':
-            planned[self.state['turn']] = {
-                'Night': self.get_final_plan_view(self.state['turn'], 'night')
-            }
-        return planned
+        self.update_game_log()
+        return self.game_planned
 
-    @functools.lru_cache(maxsize=None)
     def get_game_log(self):
-        # Fill game log with initial actions from the plan.
-        log = {
-            turn: {
-                phase: {act['trace']['ActFromPlan']['planGroup']: {
-                    'planned': {
-                        'command': act['command'],
-                        'source': act['source'],
-                        'targets': act['targets'],
-                    },
-                    'final': None,
-                    'triggers': {}
-                } for act in acts}
-                for phase, acts in phases.items()
-            } for turn, phases in self.get_game_planned().items()
+        self.update_game_log()
+        return self.game_log
+
+    def update_game_log(self):
+        """Fold phases finished since the last call into the planned actions
+        and log.
+
+        Each phase's part of these is kept in the snapshot store once built,
+        so it is only ever built once. Entries are stored as JSON, read back
+        with the codec so that IDs used as keys are ints again. Sent views may still hold the previous
+        dicts, so these are copied down to the turns that change rather than
+        updated in place.
+        """
+        with self.snapshot_files_lock, self.game_log_lock:
+            new_phases = [(phase, turn)
+                          for phase, turn in self.get_finished_phases()
+                          if (phase, turn) not in self.logged_phases]
+            if not new_phases:
+                return
+
+            planned = dict(self.game_planned)
+            log = dict(self.game_log)
+
+            raw_history = None
+            for phase, turn in new_phases:
+                key = phase.capitalize()
+
+                if ('log', phase, turn) in self.snapshots:
+                    entry = LOG_FORMAT.loads(self.snapshots.get(
+                        'log', phase, turn))
+                else:
+                    if raw_history is None:
+                        # The history as of the last finished phase covers
+                        # all of them.
+                        raw_history = self.run_snapshot_view(
+                            'view-history', ('state',) +
+                            self.get_post_phase(*new_phases[-1]))
+                    entry = self.build_phase_log_entry(phase, turn,
+                                                       raw_history)
+                    self.snapshots.put('log', phase, turn,
+                                       LOG_FORMAT.dumps(entry))
+
+                planned[turn] = dict(planned.get(turn, {}),
+                                     **{key: entry['planned']})
+                log[turn] = dict(log.get(turn, {}), **{key: entry['log']})
+
+            self.logged_phases.update(new_phases)
+            self.game_planned = planned
+            self.game_log = log
+
+    def prewarm_game_log(self):
+        """Update the game log ahead of it being asked for.
+
+        This is only ever done once a phase has already ended, so if it fails
+        the log is simply updated later, when it is asked for.
+        """
+        try:
+            self.update_game_log()
+        except Exception:
+            logger.exception("Could not update the game log.")
+
+    def build_phase_log_entry(self, phase, turn, raw_history):
+        key = phase.capitalize()
+
+        final_plan = self.get_final_plan_view(turn, phase)
+
+        acts = self.interpret_history_acts(
+            raw_history.get(turn, {}).get(key, []))
+
+        return {
+            'planned': final_plan,
+            'log': self.build_phase_log(final_plan, acts),
         }
 
+    def interpret_history_acts(self, acts):
+        return [{
+            'command': self.index.actions[act['action']].command,
+            'source': self.index.player_names[act['source']],
+            'targets': [self.index.player_names[target]
+                        for target in act['targets']],
+            'trace': act['trace'],
+        } for act in acts]
+
+    def build_phase_log(self, final_plan, acts):
+        # Fill the log with initial actions from the plan.
+        root = {act['trace']['ActFromPlan']['planGroup']: {
+            'planned': {
+                'command': act['command'],
+                'source': act['source'],
+                'targets': act['targets'],
+            },
+            'final': None,
+            'triggers': {}
+        } for act in final_plan}
+
         # Try to reconcile acts actually executed with the plan. There are
         # three scenarios here for planned acts:
         #
@@ -173,55 +486,50 @@ class Game(object):
         # Additionally, we may have acts triggered by rewrite. These are
         # placed into the triggers field and they are always regarded as
         # executed, so only the final field will be set for these acts.
-        for turn, phases in self.get_game_history().items():
-            for phase, acts in phases.items():
-                root = log[turn][phase]
+        for act in acts:
+            trace_type = next(iter(act['trace'].keys()))
+
+            final = {
+                'command': act['command'],
+                'source': act['source'],
+                'targets': act['targets'],
+            }
+
+            if trace_type == 'ActFromPlan':
+                trace = act['trace']['ActFromPlan']
+                node = root[trace['planGroup']]
+                node['final'] = final
+
+                if node['planned'] == node['final']:
+                    node['planned'] = None
+            elif trace_type == 'ActFromRewrite':
+                trace = act['trace']['ActFromRewrite']
+                trigger_path = []
 
-                for act in acts:
-                    trace_type = next(iter(act['trace'].keys()))
+                node = root
 
-                    final = {
-                        'command': act['command'],
-                        'source': act['source'],
-                        'targets': act['targets'],
-                    }
+                while True:
+                    trigger_path.append(trace['index'])
+
+                    trace = trace['dependentTrace']
+                    trace_type = next(iter(trace.keys()))
 
                     if trace_type == 'ActFromPlan':
-                        trace = act['trace']['ActFromPlan']
-                        node = root[trace['planGroup']]
-                        node['final'] = final
-
-                        if node['planned'] == node['final']:
-                            node['planned'] = None
-                    elif trace_type == 'ActFromRewrite':
-                        trace = act['trace']['ActFromRewrite']
-                        trigger_path = []
-
-                        node = root
-
-                        while True:
-                            trigger_path.append(trace['index'])
-
-                            trace = trace['dependentTrace']
-                            trace_type = next(iter(trace.keys()))
-
-                            if trace_type == 'ActFromPlan':
-                                node = root[trace['ActFromPlan']['planGroup']]
-                                break
-
-                        while trigger_path:
-                            node = node['triggers'].setdefault(
-                                trigger_path.pop(), {
-                                    'planned': None,
-                                    'final': None,
-                                    'triggers': {}
-                                })
-                        node['final'] = final
-                    else:
-                        raise ValueError('unknown trace type: {}'.format(
-                            trace_type))
-
-        return log
+                        node = root[trace['ActFromPlan']['planGroup']]
+                        break
+
+                while trigger_path:
+                    node = node['triggers'].setdefault(
+                        trigger_path.pop(), {
+                            'planned': None,
+                            'final': None,
+                            'triggers': {}
+                        })
+                node['final'] = final
+            else:
+                raise ValueError('unknown trace type: {}'.format(trace_type))
+
+        return root
 
     def get_night_result_views(self, player_id):
         results = []
@@ -238,6 +546,21 @@ class Game(object):
             results.append(self.get_day_result_view(turn, player_id))
         return results
 
+    # Result views read several snapshots each and are kept after the first
+    # call, so the async versions simply build them off the loop.
+    async def get_night_result_view_async(self, turn, player_id):
+        return await run_in_executor(self.get_night_result_view, turn,
+                                     player_id)
+
+    async def get_day_result_view_async(self, turn, player_id):
+        return await run_in_executor(self.get_day_result_view, turn, player_id)
+
+    async def get_night_result_views_async(self, player_id):
+        return await run_in_executor(self.get_night_result_views, player_id)
+
+    async def get_day_result_views_async(self, player_id):
+        return await run_in_executor(self.get_day_result_views, player_id)
+
     def interpret_messages(self, raw_plan, messages):
         out = []
 
@@ -256,27 +579,48 @@ class Game(object):
 
         return out
 
-    def get_post_suffix(self, phase, turn):
+    def get_post_phase(self, phase, turn):
         if phase == 'night':
-            return 'day.' + str(turn)
+            return 'day', turn
 
         if phase == 'day':
-            return 'night.' + str(turn + 1)
+            return 'night', turn + 1
+
+    def get_snapshot_path(self, kind, phase, turn):
+        """Get the path to a snapshot file, writing it out of the snapshot
+        store if needed."""
+        path = os.path.join(self.root,
+                            snapshots.get_file_name(kind, phase, turn))
+        if (kind, phase, turn) in self.snapshots:
+            self.snapshots.materialize(kind, phase, turn, path)
+        return path
+
+    def run_snapshot_view(self, prog, *snapshots):
+        """Run a glue view over snapshots, each given as ``(kind, phase,
+        turn)``.
+
+        Snapshots never change, so results are cached on which snapshots they
+        read, and the files are only written out for glue on a miss.
+        """
+        def run():
+            with self.snapshot_files_lock:
+                return glue.run(prog, *[self.get_snapshot_path(*snapshot)
+                                        for snapshot in snapshots])
+
+        return self.snapshot_cache.get((prog,) + snapshots, run)
 
     def get_messages_view(self, turn, phase, player_id, raw_plan):
-        state_path = self.state_path + '.' + phase + '.' + str(turn)
-        state_post_path = self.state_path + '.' + \
-                          self.get_post_suffix(phase, turn)
-
         return self.interpret_messages(
             raw_plan,
-            glue.run('view-messages', state_path, state_post_path)
-                .get(player_id, []))
+            self.run_snapshot_view(
+                'view-messages', ('state', phase, turn),
+                ('state',) + self.get_post_phase(phase, turn)
+            ).get(player_id, []))
 
     def interpret_raw_cause(self, player_id, cause):
         mod_kill_reason = cause.get('ModKilled', {}).get('reason')
         return {
-            'name': self.meta['players'][player_id]['name'],
+            'name': self.index.player_names[player_id],
             'fullRole': self.get_full_role(player_id),
             'lynched': next(iter(cause)) == 'Lynched',
             'modKillReason': mod_kill_reason,
@@ -288,30 +632,78 @@ class Game(object):
         return [self.interpret_raw_cause(player_id, cause)
                 for player_id, cause in deaths.items()]
 
-    def get_current_messages_view(self, player_id, raw_plan):
-        state_pre_path = self.state_path + '.' + self.state['phase'].lower() + \
-                         '.' + str(self.state['turn'])
-        return self.interpret_messages(
-            raw_plan,
-            glue.run('view-messages', state_pre_path, self.state_path)
-                .get(player_id, []))
+    def get_deaths_view(self, turn, phase):
+        return self.interpret_raw_deaths(self.run_snapshot_view(
+            'view-deaths', ('state', phase, turn),
+            ('state',) + self.get_post_phase(phase, turn)))
 
-    def get_current_deaths_view(self):
-        state_pre_path = self.state_path + '.' + self.state['phase'].lower() + \
-                         '.' + str(self.state['turn'])
-        return self.interpret_raw_deaths(glue.run('view-deaths', state_pre_path,
-                                                  self.state_path))
+    def get_night_result_view(self, turn, player_id):
+        return self.get_result_view('night', turn, player_id)
 
-    def get_deaths_view(self, turn, phase):
-        state_path = self.state_path + '.' + phase + '.' + str(turn)
-        state_post_path = self.state_path + '.' + \
-                          self.get_post_suffix(phase, turn)
+    def get_day_result_view(self, turn, player_id):
+        return self.get_result_view('day', turn, player_id)
 
-        return self.interpret_raw_deaths(glue.run('view-deaths', state_path,
-                                                  state_post_path))
+    def get_result_view(self, phase, turn, player_id):
+        stored = self.get_stored_result_views(phase, turn)
+        if stored is not None:
+            return stored[player_id]
 
-    @functools.lru_cache(maxsize=None)
-    def get_night_result_view(self, turn, player_id):
+        if phase == 'night':
+            build = self.build_night_result_view
+        else:
+            build = self.build_day_result_view
+        return self.views.get(('result', phase, turn, player_id),
+                              lambda: build(turn, player_id))
+
+    def get_stored_result_views(self, phase, turn):
+        return self.views.get(
+            ('stored_results', phase, turn),
+            lambda: self.load_result_views(phase, turn))
+
+    def load_result_views(self, phase, turn):
+        if ('results', phase, turn) not in self.snapshots:
+            return None
+
+        return {int(player_id): view
+                for player_id, view in json.loads(self.snapshots.get(
+                    'results', phase, turn).decode('utf-8')).items()}
+
+    def get_finished_phases(self):
+        phases = []
+        for turn in range(1, self.state['turn']):
+            phases.append(('night', turn))
+            phases.append(('day', turn))
+        if self.state['phase'] == 'Day':
+            phases.append(('night', self.state['turn']))
+        return phases
+
+    def prewarm_result_views(self):
+        """Build every player's result views for all finished phases not in
+        the snapshot store yet, and store them there, along with the game
+        log."""
+        self.prewarm_game_log()
+
+        for phase, turn in self.get_finished_phases():
+            if ('results', phase, turn) in self.snapshots:
+                continue
+
+            with self.snapshot_files_lock:
+                result_views = {
+                    player_id: self.get_result_view(phase, turn, player_id)
+                    for player_id in self.players}
+
+            with self.result_views_lock:
+                if ('results', phase, turn) not in self.snapshots:
+                    self.snapshots.put('results', phase, turn, json.dumps(
+                        result_views).encode('utf-8'))
+                    self.views.invalidate(('stored_results', phase, turn))
+                    logger.info("Stored result views for %s %d.", phase,
+                                turn)
+
+    async def prewarm_result_views_async(self):
+        await run_in_executor(self.prewarm_result_views)
+
+    def build_night_result_view(self, turn, player_id):
         raw = self.filter_raw_plan_view(player_id,
                                         self.get_raw_plan_view(turn, 'night'))
 
@@ -321,8 +713,7 @@ class Game(object):
             'plan': self.interpret_raw_plan_view(raw)
         }
 
-    @functools.lru_cache(maxsize=None)
-    def get_day_result_view(self, turn, player_id):
+    def build_day_result_view(self, turn, player_id):
         raw = self.filter_raw_plan_view(player_id,
                                         self.get_raw_plan_view(turn, 'day'))
 
@@ -338,16 +729,39 @@ class Game(object):
         }
 
     def get_player_id_map(self):
-        return {self.meta['players'][player_id]['name']: player_id
-                for player_id in self.players}
+        return self.index.player_ids
 
-    def get_current_raw_plan_view(self):
-        return glue.run('view-plan', self.state_path, self.plan_path)
+    async def get_current_raw_plan_view_async(self):
+        return await glue.run_async('view-plan', self.state_path,
+                                    self.plan_path)
 
     def get_raw_plan_view(self, turn, phase):
-        return glue.run('view-plan',
-                        self.state_path + '.' + phase + '.' + str(turn),
-                        self.plan_path + '.' + phase + '.' + str(turn))
+        return self.run_snapshot_view('view-plan', ('state', phase, turn),
+                                      ('plan', phase, turn))
+
+    def get_affected_players(self, raw_plan, action_group, source, targets,
+                             old_players=None):
+        """Get the IDs of players whose phase state a plan edit or impulse can
+        change.
+
+        These are the source, everyone planning from the same action group and
+        the targets, both those in ``raw_plan`` from before the mutation and
+        the new ones. If the players themselves changed (e.g. someone died),
+        everyone is affected.
+        """
+        if old_players is not None and old_players != self.players:
+            return set(self.players)
+
+        affected = {source}
+        for info in raw_plan:
+            if info['actionGroup'] != action_group:
+                continue
+            affected.add(info['source'])
+            if info['act'] is not None:
+                affected.update(info['act']['targets'])
+        if targets is not None:
+            affected.update(targets)
+        return affected
 
     def filter_raw_plan_view(self, player_id, raw):
         return [info for info in raw if info['source'] == player_id]
@@ -365,71 +779,85 @@ class Game(object):
         elif type == 'FruitInfo':
             pass
         elif type == 'PlayersInfo':
-            out['players'] = [self.meta['players'][player_id]['name']
+            out['players'] = [self.index.player_names[player_id]
                               for player_id in body['players']]
         elif type == 'ActionsInfo':
-            out['actions'] = list(set(self.meta['actions'][action_id]['command']
+            out['actions'] = list(set(self.index.actions[action_id].command
                                       for action_id in body['actions']))
         elif type == 'RoleInfo':
-            out['role'] = self.meta['players'][body['player']]['role'] \
+            out['role'] = self.index.players[body['player']].role \
                           if not self.players[body['player']]['vanillaized'] \
                           else 'Vanilla'
         elif type == 'GreetingInfo':
-            out['greeter'] = self.meta['players'][body['greeter']]['name']
-            out['faction'] = \
-                self.meta['factions'][body['greeterFaction']]['name']
+            out['greeter'] = self.index.player_names[body['greeter']]
+            out['faction'] = self.index.factions[body['greeterFaction']].name
 
         return out
 
     def interpret_raw_plan_view(self, raw):
         return [{
-            'command': self.meta['actions'][info['action']]['command'],
-            'description': self.meta['actions'][info['action']]['description'],
+            'command': self.index.actions[info['action']].command,
+            'description': self.index.actions[info['action']].description,
             'targets': None if info['act'] is None else [
-                self.meta['players'][target]['name']
+                self.index.player_names[target]
                 for target in info['act']['targets']],
-            'candidates': [[self.meta['players'][target]['name']
+            'candidates': [[self.index.player_names[target]
                             for target in targets]
                            for targets in info['candidates']],
             'available': info['available'],
             'compulsion': info['compulsion']
         } for info in raw]
 
-    def get_current_plan_view(self, player_id):
-        return self.interpret_raw_plan_view(
-            self.filter_raw_plan_view(player_id,
-                                      self.get_current_raw_plan_view()))
-
     def get_raw_ballot(self, turn):
-        with open(self.ballot_path + '.day.' + str(turn), 'r') as f:
-            return yaml.load(f)
+        with open(self.get_snapshot_path('ballot', 'day', turn), 'r') as f:
+            return codec.load_yaml(f)
+
+    def get_snapshot_players(self, phase, turn):
+        return self.run_snapshot_view('view-players', ('state', phase, turn))
+
+    def seed_snapshot_players(self):
+        # Right after a phase is run, the players are those of the snapshot
+        # just taken of the new state.
+        self.snapshot_cache.get(
+            ('view-players', ('state', self.state['phase'].lower(),
+                              self.state['turn'])),
+            lambda: self.players)
+
+    def get_alive_players(self, phase, turn):
+        return self.views.get(
+            ('alive', phase, turn),
+            lambda: frozenset(
+                player_id for player_id, player
+                in self.get_snapshot_players(phase, turn).items()
+                if player['causeOfDeath'] is None))
 
     def get_ballot(self, turn):
+        return self.views.get(('ballot', turn),
+                              lambda: self.build_ballot(turn))
+
+    def build_ballot(self, turn):
         raw = self.get_raw_ballot(turn)
 
-        orig_players = glue.run('view-players',
-                                self.state_path + '.day.' + str(turn))
-        players = glue.run('view-players',
-                           self.state_path + '.' +
-                           self.get_post_suffix('day', turn))
+        post_phase = self.get_post_phase('day', turn)
+        lynched = {player_id for player_id, player
+                   in self.get_snapshot_players(*post_phase).items()
+                   if player['causeOfDeath'] is not None and
+                      next(iter(player['causeOfDeath'])) == 'Lynched'}
 
-        candidates = {player_id for player_id, player in orig_players.items()
-                      if player['causeOfDeath'] is None} & \
-                     {player_id for player_id, player in players.items()
-                      if player['causeOfDeath'] is None or
-                         next(iter(player['causeOfDeath'])) == 'Lynched'}
+        candidates = self.get_alive_players('day', turn) & \
+                     (self.get_alive_players(*post_phase) | lynched)
 
         return {
             'votes': {
-                self.meta['players'][player_id]['name']:
-                    self.meta['players'][raw[player_id]]['name']
+                self.index.player_names[player_id]:
+                    self.index.player_names[raw[player_id]]
                     if player_id in raw else None
                 for player_id in candidates}
         }
 
     def get_current_raw_ballot(self):
         with open(self.ballot_path, 'r') as f:
-            return yaml.load(f)
+            return codec.load_yaml(f)
 
     def get_current_ballot(self):
         raw = self.get_current_raw_ballot()
@@ -438,11 +866,11 @@ class Game(object):
 
         return {
             'votes': {
-                self.meta['players'][player_id]['name']:
-                    self.meta['players'][raw[player_id]]['name']
+                self.index.player_names[player_id]:
+                    self.index.player_names[raw[player_id]]
                     if player_id in raw else None
                 for player_id in candidates},
-            'candidates': [self.meta['players'][player_id]['name']
+            'candidates': [self.index.player_names[player_id]
                            for player_id in candidates]
         }
 
@@ -457,31 +885,23 @@ class Game(object):
         }
 
     def get_full_role(self, player_id):
-        if self.players[player_id]['vanillaized']:
-            role = 'Vanilla'
-        else:
-            role = self.meta['players'][player_id]['role']
-
-        faction_meta = self.meta['factions'][self.players[player_id]['faction']]
-        return faction_meta['translations'].get(
-            role, faction_meta['name'] + ' ' + role)
+        return self.index.players[player_id].full_role
 
     def get_player_state(self, player_id):
         player_meta = self.meta['players'][player_id]
 
         faction_id = self.players[player_id]['faction']
-        faction_meta = self.meta['factions'][faction_id]
 
         return {
             'name': player_meta['name'],
             'fullRole': self.get_full_role(player_id),
             'abilities': player_meta['abilities'],
-            'faction': faction_meta['name'],
+            'faction': self.index.factions[faction_id].name,
             'factionIsPrimary': self.state['factions'][faction_id]['isPrimary'],
             'agenda': player_meta['agenda'],
-            'friends': [self.meta['players'][friend]['name']
+            'friends': [self.index.player_names[friend]
                         for friend in self.players[player_id]['friends']],
-            'cohorts': [self.meta['players'][cohort]['name']
+            'cohorts': [self.index.player_names[cohort]
                         if cohort is not None else None
                         for cohort in self.players[player_id]['cohorts']]
         }
@@ -494,7 +914,7 @@ class Game(object):
 
     def get_player_flips(self):
         return {
-            self.meta['players'][player_id]['name']: {
+            self.index.player_names[player_id]: {
                 'fullRole': self.get_full_role(player_id)
             } if player['causeOfDeath'] is not None else None
             for player_id, player in self.players.items()
@@ -505,15 +925,13 @@ class Game(object):
                 for player_id, player in self.meta['players'].items()}
 
     def make_poke_token(self):
-        return jwt.encode({'p': True}, self.meta['secret'],
-                          algorithm='HS256').decode('utf-8')
+        return tokens.make_poke_token(self.meta['secret'])
 
     def check_poke_token(self, token):
         return jwt.decode(token, self.meta['secret'], algorithms=['HS256'])['p']
 
     def encode_token(self, id):
-        return jwt.encode({'t': id}, self.meta['secret'],
-                          algorithm='HS256').decode('utf-8')
+        return tokens.encode_token(self.meta['secret'], id)
 
     def decode_token(self, token):
         try:
@@ -562,43 +980,49 @@ class Game(object):
 
     def make_plan(self):
         with open(self.plan_path, 'w') as f:
-            yaml.dump({}, f, default_flow_style=False)
+            codec.dump_yaml({}, f, default_flow_style=False)
 
     def make_ballot(self):
         with open(self.ballot_path, 'w') as f:
-            yaml.dump({}, f, default_flow_style=False)
+            codec.dump_yaml({}, f, default_flow_style=False)
 
     def make_actions(self):
         glue.run('view-action-groups', self.state_path, self.actions_path)
 
-    def edit_plan(self, action_group, action, source, targets):
+    def make_plan_request(self, action_group, action, source, targets):
         if self.state['phase'] != 'Night':
             raise ValueError('not night time')
 
-        glue.run('plan', self.state_path, self.actions_path, self.plan_path,
-                 input={
+        return ('plan', self.state_path, self.actions_path, self.plan_path), {
             'actionGroup': action_group,
             'action': action,
             'source': source,
             'targets': targets
-        })
+        }
 
-    def apply_impulse(self, action_group, action, source, targets):
+    async def edit_plan_async(self, action_group, action, source, targets):
+        await self.apply_request_async(
+            self.make_plan_request(action_group, action, source, targets),
+            Change.PLAN, source)
+
+    def make_impulse_request(self, action_group, action, source, targets):
         if self.state['phase'] != 'Day':
             raise ValueError('not day time')
 
-        glue.run('impulse', self.state_path, self.actions_path, self.plan_path,
-                 input={
+        return ('impulse', self.state_path, self.actions_path,
+                self.plan_path), {
             'actionGroup': action_group,
             'action': action,
             'source': source,
             'targets': targets
-        })
+        }
 
-        self.load_state()
-        self.load_players()
+    async def apply_impulse_async(self, action_group, action, source, targets):
+        await self.apply_request_async(
+            self.make_impulse_request(action_group, action, source, targets),
+            Change.STATE)
 
-    def vote(self, source, target):
+    def make_vote_request(self, source, target):
         if self.state['phase'] != 'Day':
             raise ValueError('not day time')
 
@@ -607,22 +1031,44 @@ class Game(object):
                          self.meta['schedule']['twilight_duration']:
             raise ValueError('in twilight')
 
-        return glue.run('vote', self.state_path, self.ballot_path, input={
+        return ('vote', self.state_path, self.ballot_path), {
             'source': source,
             'target': target
-        })
+        }
 
-    def modkill(self, target, reason):
-        glue.run('modkill', self.state_path, self.plan_path, input={
-            'target': next(player_id
-                           for player_id, player in self.meta['players'].items()
-                           if player['name'] == target),
+    async def vote_async(self, source, target):
+        return await self.apply_request_async(
+            self.make_vote_request(source, target), Change.BALLOT, source)
+
+    def make_modkill_request(self, target, reason):
+        return ('modkill', self.state_path, self.plan_path), {
+            'target': self.index.get_player_id(target),
             'reason': reason,
             'modifyPlan': self.state['phase'] == 'Night'
-        })
+        }
 
-        self.load_state()
-        self.load_players()
+    async def modkill_async(self, target, reason):
+        await self.apply_request_async(
+            self.make_modkill_request(target, reason), Change.STATE)
+
+    async def apply_request_async(self, request, kind, player_id=None):
+        """Run a request made by one of the ``make_*_request`` methods
+        through glue, and bump the version with a change of ``kind``.
+
+        Returns what glue returned.
+        """
+        args, input = request
+        result = await glue.run_async(*args, input=input)
+
+        if kind == Change.STATE:
+            self.invalidate_winners()
+
+            # Nothing read from the state itself changes mid-phase, only
+            # players.
+            await self.load_players_async()
+
+        self.bump_version(kind, player_id)
+        return result
 
     def finish_phase(self):
         if self.state['phase'] == 'Night':
@@ -633,11 +1079,24 @@ class Game(object):
             raise ValueError('cannot finish this phase')
 
         self.meta['schedule']['phase_end'] = self.get_next_end()
+        self.bump_version(Change.PHASE)
         self.save_meta()
+        self.flush()
+
+        # Fold the phase into the log while its snapshots are still written
+        # out.
+        self.prewarm_game_log()
+        self.prune_snapshot_files()
+
+    async def finish_phase_async(self):
+        # Phase resolution is a sequence of file moves and glue runs that must
+        # happen in order, so it runs as a whole off the loop.
+        await run_in_executor(self.finish_phase)
 
     def skip_to_twilight(self):
         self.meta['schedule']['phase_end'] = \
             time.time() + self.meta['schedule']['twilight_duration']
+        self.bump_version(Change.META)
         self.save_meta()
 
     def run_day(self):
@@ -651,11 +1110,16 @@ class Game(object):
 
         glue.run('run-day', self.state_path, ballot_path)
 
-        shutil.copy(self.state_path, self.state_path + '.night.' +
-                    str(self.state['turn'] + 1))
+        self.archive_snapshot('ballot', 'day', self.state['turn'], ballot_path)
+        self.archive_snapshot('actions', 'day', self.state['turn'],
+                              actions_path)
+        self.archive_snapshot('plan', 'day', self.state['turn'], plan_path)
+        self.archive_snapshot('state', 'night', self.state['turn'] + 1,
+                              self.state_path)
 
         self.load_state()
         self.load_players()
+        self.seed_snapshot_players()
 
         self.make_plan()
         self.make_actions()
@@ -669,11 +1133,15 @@ class Game(object):
 
         glue.run('run-night', self.state_path, actions_path, plan_path)
 
-        shutil.copy(self.state_path, self.state_path + '.day.' +
-                    str(self.state['turn']))
+        self.archive_snapshot('actions', 'night', self.state['turn'],
+                              actions_path)
+        self.archive_snapshot('plan', 'night', self.state['turn'], plan_path)
+        self.archive_snapshot('state', 'day', self.state['turn'],
+                              self.state_path)
 
         self.load_state()
         self.load_players()
+        self.seed_snapshot_players()
 
         self.make_ballot()
         self.make_actions()
@@ -690,8 +1158,24 @@ class Game(object):
             self.meta['schedule']['phase_end'] = self.get_next_end()
             self.save_meta()
 
-        state_path = self.state_path + '.night.' + str(self.state['turn'])
+        imported = self.snapshots.import_files()
+        if imported:
+            logger.info("Packed %d loose snapshot files.", imported)
 
-        if not os.path.exists(state_path):
+        if ('state', 'night', self.state['turn']) not in self.snapshots:
             logger.info("No initial night state found -- copying state.")
-            shutil.copy(self.state_path, state_path)
+            self.archive_snapshot('state', 'night', self.state['turn'],
+                                  self.state_path)
+
+        self.prune_snapshot_files()
+
+    def archive_snapshot(self, kind, phase, turn, path):
+        if (kind, phase, turn) not in self.snapshots:
+            self.snapshots.put_file(kind, phase, turn, path)
+
+    def prune_snapshot_files(self):
+        # Keep the snapshot the current phase is viewed against around, since
+        # it is read on every update.
+        with self.snapshot_files_lock:
+            self.snapshots.prune_files(keep=[
+                ('state', self.state['phase'].lower(), self.state['turn'])])
@@ -1,29 +1,446 @@
+import asyncio
+import functools
 import os
+import queue
 import shlex
+import struct
 import subprocess
-import yaml
+import threading
+
+from padrino import codec
 
 COSANOSTRA_GLUE_BIN_DIR = os.environ['COSANOSTRA_GLUE_BIN_DIR']
 COSANOSTRA_GLUE_ARGS = shlex.split(os.environ.get('COSANOSTRA_GLUE_ARGS', ''))
 
+# Wire format for glue input and output: yaml (the glue default), json or
+# msgpack. Anything other than yaml is passed to glue as --format=<name>.
+COSANOSTRA_GLUE_FORMAT = os.environ.get('COSANOSTRA_GLUE_FORMAT', 'yaml')
+
+# Resident worker mode. COSANOSTRA_GLUE_WORKER names the glue binary that
+# serves framed requests, and COSANOSTRA_GLUE_WORKERS sizes the pool (0 keeps
+# the one-shot behavior).
+COSANOSTRA_GLUE_WORKER = os.environ.get('COSANOSTRA_GLUE_WORKER', 'worker')
+COSANOSTRA_GLUE_WORKERS = int(os.environ.get('COSANOSTRA_GLUE_WORKERS', '0'))
+
+# Default per-call limits: seconds before glue is killed, and bytes of output
+# it may produce. Unset means no limit.
+COSANOSTRA_GLUE_TIMEOUT = float(os.environ['COSANOSTRA_GLUE_TIMEOUT']) \
+    if os.environ.get('COSANOSTRA_GLUE_TIMEOUT') else None
+COSANOSTRA_GLUE_MAX_OUTPUT = int(os.environ['COSANOSTRA_GLUE_MAX_OUTPUT']) \
+    if os.environ.get('COSANOSTRA_GLUE_MAX_OUTPUT') else None
+
+_READ_SIZE = 64 * 1024
+
+_FRAME_HEADER = struct.Struct('>I')
+
+_pool = None
+
+
 class GlueError(Exception):
     pass
 
 
-def run(prog, *args, input=None):
+class WorkerDied(GlueError):
+    pass
+
+
+class GlueTimeout(GlueError):
+    pass
+
+
+class OutputTooLarge(GlueError):
+    pass
+
+
+class _Deadline(object):
+    """Kills a process if it runs for longer than ``timeout`` seconds."""
+
+    def __init__(self, proc, timeout):
+        self.proc = proc
+        self.expired = False
+        self.timer = None
+
+        if timeout is not None:
+            self.timer = threading.Timer(timeout, self.expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def expire(self):
+        self.expired = True
+        self.proc.kill()
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+
+
+class _LimitedReader(object):
+    """A file-like view of a pipe that refuses to read more than ``limit``
+    bytes, for handing to streaming decoders."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.count = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.count += len(chunk)
+        if self.limit is not None and self.count > self.limit:
+            raise OutputTooLarge('glue output exceeded {} bytes'.format(
+                self.limit))
+        return chunk
+
+
+class Worker(object):
+    """A resident glue process.
+
+    Requests and responses are documents in the worker's wire format, each
+    prefixed with its length as a 4-byte big-endian integer. A request looks like::
+
+        {prog: view-plan, args: [state.yml, plan.yml], input: null}
+
+    and the response is either ``{result: ...}`` or ``{error: ...}``. A batch
+    request carries a list of requests under ``batch`` and is answered with a
+    list of responses under ``results``, in the same order.
+    """
+
+    def __init__(self, format=COSANOSTRA_GLUE_FORMAT):
+        self.format = codec.get_format(format)
+        self.proc = subprocess.Popen([
+            os.path.join(os.environ['COSANOSTRA_GLUE_BIN_DIR'],
+                         COSANOSTRA_GLUE_WORKER),
+        ] + COSANOSTRA_GLUE_ARGS + format_args(self.format),
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        # Set once a request fails without a response being read in full, as
+        # part of one may still be in the pipe.
+        self.failed = False
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def write_frame(self, payload):
+        raw = self.format.dumps(payload)
+        self.proc.stdin.write(_FRAME_HEADER.pack(len(raw)) + raw)
+        self.proc.stdin.flush()
+
+    def read_exactly(self, n):
+        buf = self.proc.stdout.read(n)
+        if len(buf) != n:
+            raise WorkerDied('glue worker exited with code {}'.format(
+                self.proc.wait()))
+        return buf
+
+    def read_frame(self, max_output=None):
+        n, = _FRAME_HEADER.unpack(self.read_exactly(_FRAME_HEADER.size))
+        if max_output is not None and n > max_output:
+            # The rest of the frame is still in the pipe, so this worker can't
+            # be reused.
+            self.proc.kill()
+            self.proc.wait()
+            raise OutputTooLarge('glue output exceeded {} bytes'.format(
+                max_output))
+        return self.format.loads(self.read_exactly(n))
+
+    def send(self, payload, timeout=None, max_output=None):
+        deadline = _Deadline(self.proc, timeout)
+        try:
+            try:
+                self.write_frame(payload)
+            except (BrokenPipeError, OSError):
+                raise WorkerDied('glue worker is not accepting requests')
+            return self.read_frame(max_output)
+        except WorkerDied:
+            self.failed = True
+            if deadline.expired:
+                raise GlueTimeout('glue timed out after {}s'.format(timeout))
+            raise
+        except BaseException:
+            self.failed = True
+            raise
+        finally:
+            deadline.cancel()
+
+    def request(self, prog, args, input=None, **limits):
+        return unpack_response(self.send({
+            'prog': prog,
+            'args': list(args),
+            'input': input
+        }, **limits))
+
+    def request_batch(self, commands, **limits):
+        return [unpack_response(response) for response in self.send({
+            'batch': [{
+                'prog': prog,
+                'args': list(args),
+                'input': None
+            } for prog, *args in commands]
+        }, **limits)['results']]
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stdout.close()
+
+
+class Pool(object):
+    """A fixed-size pool of resident glue workers.
+
+    Workers are spawned on first use and replaced if they crash, so a dead
+    worker only fails the request it was serving.
+    """
+
+    def __init__(self, size, format=COSANOSTRA_GLUE_FORMAT):
+        self.size = size
+        self.format = format
+        self.slots = queue.LifoQueue()
+        for _ in range(size):
+            self.slots.put(None)
+
+    def run(self, prog, *args, input=None, timeout=None, max_output=None):
+        return self.with_worker(lambda worker: worker.request(
+            prog, args, input=input, timeout=timeout, max_output=max_output))
+
+    def run_batch(self, commands, timeout=None, max_output=None):
+        return self.with_worker(lambda worker: worker.request_batch(
+            commands, timeout=timeout, max_output=max_output))
+
+    def with_worker(self, f):
+        worker = self.slots.get()
+        try:
+            if worker is None or not worker.is_alive():
+                worker = None
+                worker = Worker(self.format)
+            return f(worker)
+        finally:
+            if worker is not None and worker.failed:
+                worker.close()
+                worker = None
+            self.slots.put(worker)
+
+    def close(self):
+        for _ in range(self.size):
+            worker = self.slots.get()
+            if worker is not None:
+                worker.close()
+
+
+def format_args(format):
+    if format.name == 'yaml':
+        return []
+    return ['--format=' + format.name]
+
+
+def get_limits(timeout, max_output):
+    return (COSANOSTRA_GLUE_TIMEOUT if timeout is None else timeout,
+            COSANOSTRA_GLUE_MAX_OUTPUT if max_output is None else max_output)
+
+
+def unpack_response(response):
+    if response.get('error') is not None:
+        raise GlueError(response['error'])
+    return response.get('result')
+
+
+def start_pool(size=COSANOSTRA_GLUE_WORKERS, format=COSANOSTRA_GLUE_FORMAT):
+    global _pool
+
+    stop_pool()
+    if size > 0:
+        _pool = Pool(size, format)
+
+
+def stop_pool():
+    global _pool
+
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def run(prog, *args, input=None, format=None, timeout=None, max_output=None):
+    """Run a glue command.
+
+    ``format`` picks the wire format for a one-shot call; the worker pool
+    always speaks the format it was started with. ``timeout`` (in seconds)
+    and ``max_output`` (in bytes) default to COSANOSTRA_GLUE_TIMEOUT and
+    COSANOSTRA_GLUE_MAX_OUTPUT.
+    """
+    timeout, max_output = get_limits(timeout, max_output)
+
+    if _pool is not None:
+        return _pool.run(prog, *args, input=input, timeout=timeout,
+                         max_output=max_output)
+    return run_once(prog, *args, input=input, format=format, timeout=timeout,
+                    max_output=max_output)
+
+
+async def run_async(prog, *args, input=None, format=None, timeout=None,
+                    max_output=None):
+    """Run a glue command without blocking the event loop."""
+    timeout, max_output = get_limits(timeout, max_output)
+
+    if _pool is not None:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(_pool.run, prog, *args, input=input,
+                                    timeout=timeout, max_output=max_output))
+
+    format = codec.get_format(format or COSANOSTRA_GLUE_FORMAT)
+
+    proc = await asyncio.create_subprocess_exec(
+        os.path.join(os.environ['COSANOSTRA_GLUE_BIN_DIR'], prog),
+        *COSANOSTRA_GLUE_ARGS + format_args(format) + list(args),
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    tasks = [
+        asyncio.ensure_future(_feed_async(
+            proc.stdin, format.dumps(input) if input is not None else None)),
+        asyncio.ensure_future(_read_async(proc.stdout, max_output)),
+        asyncio.ensure_future(_read_async(proc.stderr, None)),
+    ]
+    try:
+        _, out, err = await asyncio.wait_for(asyncio.gather(*tasks), timeout)
+    except (asyncio.TimeoutError, OutputTooLarge) as e:
+        await _kill_async(proc, tasks)
+        if isinstance(e, OutputTooLarge):
+            raise
+        raise GlueTimeout('{} timed out after {}s'.format(prog, timeout))
+
+    if await proc.wait() != 0:
+        raise GlueError(err.decode('utf-8').strip())
+
+    try:
+        return format.loads(out)
+    except Exception as e:
+        raise GlueError('could not decode output of {}: {}'.format(prog, e))
+
+
+async def _kill_async(proc, tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    proc.kill()
+    # The process only counts as finished once its pipes are drained.
+    await asyncio.gather(proc.stdout.read(), proc.stderr.read())
+    await proc.wait()
+
+
+async def _feed_async(stdin, data):
+    try:
+        if data is not None:
+            stdin.write(data)
+            await stdin.drain()
+        stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # glue doesn't have to read its input before failing.
+        pass
+
+
+async def _read_async(stream, limit):
+    chunks = []
+    count = 0
+    while True:
+        chunk = await stream.read(_READ_SIZE)
+        if not chunk:
+            return b''.join(chunks)
+        count += len(chunk)
+        if limit is not None and count > limit:
+            raise OutputTooLarge('glue output exceeded {} bytes'.format(limit))
+        chunks.append(chunk)
+
+
+async def run_batch_async(commands, timeout=None, max_output=None):
+    """Run several view commands in one round-trip.
+
+    Each command is a tuple of ``(prog, *args)``. Duplicate commands are only
+    run once, and the results are returned in the order of ``commands``.
+    """
+    timeout, max_output = get_limits(timeout, max_output)
+
+    commands = [tuple(command) for command in commands]
+    unique = list(dict.fromkeys(commands))
+
+    if _pool is not None:
+        results = await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(_pool.run_batch, unique, timeout=timeout,
+                                    max_output=max_output))
+    else:
+        results = await asyncio.gather(*[
+            run_async(*command, timeout=timeout, max_output=max_output)
+            for command in unique])
+
+    results = dict(zip(unique, results))
+    return [results[command] for command in commands]
+
+
+def run_once(prog, *args, input=None, format=None, timeout=None,
+             max_output=None):
+    format = codec.get_format(format or COSANOSTRA_GLUE_FORMAT)
+
     proc = subprocess.Popen([
         os.path.join(os.environ['COSANOSTRA_GLUE_BIN_DIR'], prog),
-    ] + COSANOSTRA_GLUE_ARGS + list(args),
+    ] + COSANOSTRA_GLUE_ARGS + format_args(format) + list(args),
     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-    if input is not None:
-        proc.stdin.write(yaml.dump(input).encode('utf-8'))
-        proc.stdin.close()
+    # Feed stdin and drain stderr on their own threads while stdout is decoded
+    # as it arrives, so that a full pipe on one side can never stall glue.
+    err = []
+    feeder = threading.Thread(target=_feed, args=(
+        proc.stdin, format.dumps(input) if input is not None else None))
+    drainer = threading.Thread(target=lambda: err.append(proc.stderr.read()))
+    feeder.start()
+    drainer.start()
+
+    deadline = _Deadline(proc, timeout)
+    stdout = _LimitedReader(proc.stdout, max_output)
+    decode_error = None
+    try:
+        try:
+            result = format.load(stdout)
+            # Make sure glue isn't left blocked on anything we didn't decode.
+            while stdout.read(_READ_SIZE):
+                pass
+        except OutputTooLarge:
+            proc.kill()
+            raise
+        except Exception as e:
+            # Whether this matters depends on how glue exited.
+            result, decode_error = None, e
+    finally:
+        deadline.cancel()
+        retcode = proc.wait()
+        feeder.join()
+        drainer.join()
+        proc.stdout.close()
+        proc.stderr.close()
 
-    err = proc.stderr.read().decode('utf-8').strip()
+    if deadline.expired and retcode != 0:
+        raise GlueTimeout('{} timed out after {}s'.format(prog, timeout))
 
-    retcode = proc.wait()
     if retcode != 0:
-        raise GlueError(err)
+        raise GlueError(b''.join(err).decode('utf-8').strip())
+
+    if decode_error is not None:
+        raise GlueError('could not decode output of {}: {}'.format(
+            prog, decode_error))
+
+    return result
+
 
-    return yaml.load(proc.stdout)
+def _feed(stdin, data):
+    try:
+        if data is not None:
+            stdin.write(data)
+        stdin.close()
+    except BrokenPipeError:
+        # glue doesn't have to read its input before failing.
+        pass
@@ -0,0 +1,70 @@
+"""Lookup tables over a game's meta and players.
+
+Views look up names, commands and roles for IDs many times per message, so
+these are built once rather than dug out of the nested meta dicts each time.
+"""
+
+
+class Player(object):
+    __slots__ = ('id', 'name', 'role', 'full_role')
+
+    def __init__(self, id, name, role):
+        self.id = id
+        self.name = name
+        self.role = role
+        self.full_role = None
+
+
+class Action(object):
+    __slots__ = ('id', 'command', 'description')
+
+    def __init__(self, id, command, description):
+        self.id = id
+        self.command = command
+        self.description = description
+
+
+class Faction(object):
+    __slots__ = ('id', 'name', 'translations')
+
+    def __init__(self, id, name, translations):
+        self.id = id
+        self.name = name
+        self.translations = translations
+
+    def get_full_role(self, role):
+        return self.translations.get(role, self.name + ' ' + role)
+
+
+class Index(object):
+    def __init__(self, meta):
+        self.players = {
+            player_id: Player(player_id, player['name'], player['role'])
+            for player_id, player in meta['players'].items()}
+        self.actions = {
+            action_id: Action(action_id, action['command'],
+                              action['description'])
+            for action_id, action in meta['actions'].items()}
+        self.factions = {
+            faction_id: Faction(faction_id, faction['name'],
+                                faction['translations'])
+            for faction_id, faction in meta['factions'].items()}
+
+        self.player_names = {player_id: player.name
+                             for player_id, player in self.players.items()}
+        self.player_ids = {player.name: player_id
+                           for player_id, player in self.players.items()}
+
+    def update_players(self, players):
+        """Refresh what depends on the players' current state."""
+        for player_id, player in players.items():
+            record = self.players[player_id]
+            role = 'Vanilla' if player['vanillaized'] else record.role
+            record.full_role = \
+                self.factions[player['faction']].get_full_role(role)
+
+    def get_player_id(self, name):
+        try:
+            return self.player_ids[name]
+        except KeyError:
+            raise ValueError('unknown player: {}'.format(name))
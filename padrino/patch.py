@@ -0,0 +1,47 @@
+"""Minimal JSON-Patch (RFC 6902) diffs between JSON-like documents.
+
+Only ``add``, ``remove`` and ``replace`` are produced. Lists are diffed
+element by element and grown or shrunk at the end, which is how game views
+change (deaths, log entries and messages are appended).
+"""
+
+
+def escape(token):
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def make_patch(old, new, path=''):
+    """Make a list of operations that turn ``old`` into ``new``."""
+    if old is new:
+        return []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': path + '/' + escape(key)})
+
+        for key, value in new.items():
+            key_path = path + '/' + escape(key)
+            if key not in old:
+                ops.append({'op': 'add', 'path': key_path, 'value': value})
+            else:
+                ops.extend(make_patch(old[key], value, key_path))
+        return ops
+
+    if isinstance(old, list) and isinstance(new, list):
+        ops = []
+        for i, (old_value, value) in enumerate(zip(old, new)):
+            ops.extend(make_patch(old_value, value, path + '/' + str(i)))
+
+        for i in range(len(old) - 1, len(new) - 1, -1):
+            ops.append({'op': 'remove', 'path': path + '/' + str(i)})
+
+        for value in new[len(old):]:
+            ops.append({'op': 'add', 'path': path + '/-', 'value': value})
+        return ops
+
+    if type(old) is type(new) and old == new:
+        return []
+
+    return [{'op': 'replace', 'path': path, 'value': new}]
@@ -1,148 +1,325 @@
+import asyncio
 import datetime
-import functools
+import heapq
+import itertools
 import json
 import jwt
 import logging
 import os
 import re
+import tempfile
 import time
+import tornado.httpserver
 import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
 import tornado.options
+import tornado.process
 import tornado.web
 import tornado.websocket
 import yaml
 
+from padrino import admission
+from padrino import bus
 from padrino import game
+from padrino import glue
+from padrino import patch
+from padrino import storage
 
 logger = logging.getLogger(__name__)
 
+# Game versions start over on every run and every time a game is loaded, so
+# tags built from them need both of these.
+STARTED = int(time.time())
+LOADS = itertools.count()
+
 
 tornado.options.define('debug', default=False, help='debug mode')
 tornado.options.define('game_path', default='game', help='path to the game')
+tornado.options.define('games_path', default=None, type=str,
+                       help='directory of games to host at /g/<name>/, '
+                            'instead of the single game at game_path')
+tornado.options.define('game_idle_timeout', default=600,
+                       help='seconds after which a game with no connections '
+                            'is unloaded, when hosting several games')
+tornado.options.define('storage', default=None, type=str,
+                       help='how games are stored: files or sqlite (by '
+                            'default, sqlite for games that have a database)')
+tornado.options.define('fast_start', default=False,
+                       help='listen before games are loaded, warm their '
+                            'caches in the background, and leave player '
+                            'tokens to /_tokens or padrino.tokens')
 tornado.options.define('listen_port', default=8888, help='port to listen on')
 tornado.options.define('listen_host', default='127.0.0.1',
                        help='host to listen on')
+tornado.options.define('server_workers', default=1,
+                       help='number of server processes to fan sockets out '
+                            'over; the first owns the games')
+tornado.options.define('bus_path', default=None, type=str,
+                       help='Unix socket the server processes talk over')
+tornado.options.define('message_rate', default=5.0,
+                       help='changes a second each connection may send, on '
+                            'average (0 for no limit)')
+tornado.options.define('message_burst', default=10,
+                       help='changes each connection may send at once')
+tornado.options.define('player_message_rate', default=10.0,
+                       help='changes a second each player may send over all '
+                            'of their connections (0 for no limit)')
+tornado.options.define('player_message_burst', default=20,
+                       help='changes each player may send at once')
+tornado.options.define('max_pending_messages', default=256,
+                       help='changes that may wait on games at once before '
+                            'more are rejected (0 for no limit)')
+tornado.options.define('glue_workers', default=glue.COSANOSTRA_GLUE_WORKERS,
+                       help='number of resident glue workers (0 to spawn one '
+                            'glue process per call)')
+
+
+GAME_ID_RE = re.compile(r'^[\w-]+$')
+
+
+class HostMixin(object):
+    """Looks up the game a request is for, loading it if needed."""
+
+    def initialize(self, hosts):
+        self.hosts = hosts
+
+    async def prepare(self):
+        try:
+            self.host = await self.hosts.get(*self.path_args)
+        except KeyError:
+            raise tornado.web.HTTPError(404)
+
+        self.game = self.host.game
+        self.connections = self.host.connections
+        self.updater = self.host.updater
+        self.roots = self.host.roots
+        self.admission = self.host.admission
+        self.player_buckets = self.host.player_buckets
 
 
 class MainHandler(tornado.web.RequestHandler):
-    def get(self):
+    def initialize(self, hosts):
+        self.hosts = hosts
+
+    @tornado.web.addslash
+    def get(self, *args):
+        try:
+            self.hosts.get_path(*args)
+        except KeyError:
+            raise tornado.web.HTTPError(404)
+
         self.render('main.html')
 
 
-class GameSocketHandler(tornado.websocket.WebSocketHandler):
-    def initialize(self, game, connections, updater):
-        self.game = game
-        self.connections = connections
-        self.updater = updater
+class PlayerConnection(object):
+    """A player's connection to a game, wherever its socket is held.
+
+    Subclasses provide ``write_message``, ``close``, ``ping`` and
+    ``is_closed``, and set up ``game``, ``connections``, ``updater``,
+    ``roots``, ``admission`` and ``player_buckets`` from the game's host.
+    """
+
+    # Messages that change the game or resend its whole root, and so are
+    # subject to admission.
+    ADMITTED = frozenset(['plan', 'vote', 'impulse', 'will', 'resync'])
+
+    def init_connection(self):
         self.me_id = None
 
-    def open(self):
-        token = self.get_argument('token')
+        # The root state this client was last sent, which patches are made
+        # against, and its version.
+        self.root = {}
+        self.version = 0
+
+        # Token buckets for this connection and its player, set up on start.
+        self.bucket = None
+        self.player_bucket = None
+
+    async def start(self, token):
+        start = time.monotonic()
+
         try:
-            self.me_id = self.game.decode_token(token)
+            me_id = self.game.decode_token(token)
         except ValueError:
             self.close(4000, "Invalid token.")
             return
-        self.connections.setdefault(self.me_id, set()).add(self)
 
-        # Send root state information.
+        async with self.game.lock:
+            root, body = await self.roots.get(me_id)
+
+            if self.is_closed():
+                # The client went away while we were building its state.
+                return
+
+            self.root = root
+            for other in self.connections.get(me_id, ()):
+                if other.root == self.root:
+                    # Share the root with the player's other connections, so
+                    # that updates to all of them are only encoded once.
+                    self.root = other.root
+                    self.version = other.version
+                    break
+            self.me_id = me_id
+
+            self.bucket = self.admission.make_bucket()
+            if me_id not in self.player_buckets:
+                self.player_buckets[me_id] = \
+                    self.admission.make_player_bucket()
+            self.player_bucket = self.player_buckets[me_id]
+
+            # Send root state information.
+            self.write_message(
+                b'{"type": "root", "body": ' + body +
+                ', "version": {}, "id": {}}}'.format(
+                    self.version, json.dumps(self.me_id)).encode('utf-8'))
+
+            # Only start receiving updates once the root state is out.
+            self.connections.setdefault(self.me_id, set()).add(self)
+
+        self.roots.record_first_message(time.monotonic() - start)
+
+    def send_root(self, **extra):
         self.write_message({
             'type': 'root',
-            'body': {
-                'publicState': self.game.get_public_state(),
-                'playerState': self.game.get_player_state(self.me_id),
-                'publicInfo': self.game.get_public_info(),
-                'phaseState': self.game.get_phase_state(self.me_id),
-                'will': self.game.get_will(self.me_id),
-                'nightResults': self.game.get_night_result_views(self.me_id),
-                'dayResults': self.game.get_day_result_views(self.me_id)
-            },
+            'body': dict(self.root, **extra),
+            'version': self.version,
             'id': self.me_id
         })
 
-    def on_close(self):
+    def send_update(self, body, broadcast=None):
+        """Send changes to the root state as a patch against what this client
+        was last sent."""
+        if broadcast is None:
+            broadcast = Broadcast()
+
+        # Connections that were sent the same root get the same patch.
+        old_root = self.root
+        self.root, frame = broadcast.memo(
+            ('patch', id(old_root), id(body), self.version), (old_root, body),
+            lambda: self.make_update(old_root, body, broadcast))
+
+        if frame is not None:
+            self.version += 1
+            broadcast.write(self, frame)
+
+    def make_update(self, root, body, broadcast):
+        ops = []
+        for key, value in body.items():
+            if key in root:
+                ops.extend(patch.make_patch(root[key], value,
+                                            '/' + patch.escape(key)))
+            else:
+                ops.append({'op': 'add', 'path': '/' + patch.escape(key),
+                            'value': value})
+        if not ops:
+            return root, None
+
+        return dict(root, **body), broadcast.encode({
+            'type': 'patch',
+            'body': ops,
+            'version': self.version + 1,
+            'id': self.me_id
+        })
+
+    def send_phase_end(self, body, broadcast=None):
+        if broadcast is None:
+            broadcast = Broadcast()
+
+        # Connections that shared a root keep sharing one, so that later
+        # patches to them are still only made once.
+        old_root = self.root
+        self.root = broadcast.memo(
+            ('pend_root', id(old_root), id(body)), (old_root, body),
+            lambda: dict(old_root, publicState=body['publicState'],
+                         playerState=body['playerState'],
+                         phaseState=body['phaseState']))
+        self.version += 1
+        broadcast.write(self, broadcast.memo(
+            ('pend', id(body), self.version), body,
+            lambda: broadcast.encode({
+                'type': 'pend',
+                'body': body,
+                'version': self.version,
+                'id': self.me_id
+            })))
+
+    def stop(self):
         if self.me_id is not None:
-            self.connections[self.me_id].remove(self)
+            self.connections[self.me_id].discard(self)
 
-    def on_impulse_message(self, body):
+    async def on_impulse_message(self, body):
         if body['targets'] is None:
             return
 
         players = self.game.get_player_id_map()
-        raw = self.game.filter_raw_plan_view(
-            self.me_id, self.game.get_current_raw_plan_view())[body['i']]
+        raw_plan = await self.game.get_current_raw_plan_view_async()
+        raw = self.game.filter_raw_plan_view(self.me_id, raw_plan)[body['i']]
 
         targets = [players[player_name] for player_name in body['targets']]
 
-        old_phase_states = {player_id: self.game.get_phase_state(player_id)
-                            for player_id in self.connections}
-
-        self.game.apply_impulse(raw['actionGroup'], raw['action'], self.me_id,
-                                targets)
-
-        if self.game.is_game_over():
-            self.updater.run()
-
-        # Notify other users about our plan edit.
-        for player_id, connections in self.connections.items():
-            phase_state = self.game.get_phase_state(player_id)
-
-            if phase_state == old_phase_states[player_id]:
-                # Only send updated plans to users.
-                continue
-
-            public_state = self.game.get_public_state()
-            player_state = self.game.get_player_state(player_id)
-
-            for connection in connections:
-                connection.write_message({
-                    'type': 'root',
-                    'body': {
-                        'publicState': public_state,
-                        'playerState': player_state,
-                        'phaseState': phase_state
-                    },
-                    'id': player_id
-                })
-
-    def on_plan_message(self, body):
+        old_players = self.game.players
+
+        await self.game.apply_impulse_async(raw['actionGroup'], raw['action'],
+                                            self.me_id, targets)
+
+        affected = self.game.get_affected_players(
+            raw_plan, raw['actionGroup'], self.me_id, targets, old_players)
+
+        if await self.game.is_game_over_async():
+            await self.updater.run()
+            affected = set(self.game.players)
+
+        # Notify affected users about our impulse.
+        player_ids = [player_id for player_id in self.connections
+                      if player_id in affected]
+        phase_states = await self.game.get_phase_states_async(player_ids)
+        public_state = self.game.get_public_state()
+        broadcast = Broadcast()
+        for player_id in player_ids:
+            update = {
+                'publicState': public_state,
+                'playerState': self.game.get_player_state(player_id),
+                'phaseState': phase_states[player_id]
+            }
+            for connection in self.connections[player_id]:
+                connection.send_update(update, broadcast)
+        broadcast.report('impulse')
+
+    async def on_plan_message(self, body):
         players = self.game.get_player_id_map()
-        raw = self.game.filter_raw_plan_view(
-            self.me_id, self.game.get_current_raw_plan_view())[body['i']]
-
-        old_phase_states = {player_id: self.game.get_phase_state(player_id)
-                            for player_id in self.connections}
+        raw_plan = await self.game.get_current_raw_plan_view_async()
+        raw = self.game.filter_raw_plan_view(self.me_id, raw_plan)[body['i']]
 
         if body['targets'] is None:
             targets = None
         else:
             # We have to first unplan the action before planning it.
-            self.game.edit_plan(raw['actionGroup'], raw['action'], self.me_id,
-                                None)
+            await self.game.edit_plan_async(raw['actionGroup'], raw['action'],
+                                            self.me_id, None)
             targets = [players[player_name]
                        for player_name in body['targets']]
 
-        self.game.edit_plan(raw['actionGroup'], raw['action'],
-                            self.me_id, targets)
-
-        # Notify other users about our plan edit.
-        for player_id, connections in self.connections.items():
-            phase_state = self.game.get_phase_state(player_id)
-
-            if phase_state == old_phase_states[player_id]:
-                # Only send updated plans to users.
-                continue
-
-            for connection in connections:
-                connection.write_message({
-                    'type': 'root',
-                    'body': {
-                        'phaseState': phase_state
-                    },
-                    'id': player_id
-                })
-
-    def on_vote_message(self, body):
+        await self.game.edit_plan_async(raw['actionGroup'], raw['action'],
+                                        self.me_id, targets)
+
+        affected = self.game.get_affected_players(
+            raw_plan, raw['actionGroup'], self.me_id, targets)
+
+        # Notify affected users about our plan edit.
+        player_ids = [player_id for player_id in self.connections
+                      if player_id in affected]
+        phase_states = await self.game.get_phase_states_async(player_ids)
+        broadcast = Broadcast()
+        for player_id in player_ids:
+            update = {
+                'phaseState': phase_states[player_id]
+            }
+            for connection in self.connections[player_id]:
+                connection.send_update(update, broadcast)
+        broadcast.report('plan')
+
+    async def on_vote_message(self, body):
         players = self.game.get_player_id_map()
         if body['target'] is None:
             target = None
@@ -150,53 +327,75 @@ class GameSocketHandler(tornado.websocket.WebSocketHandler):
             target = players[body['target']]
 
         # We can't compute the majority ourselves due to vote thief etc.
-        consensus_met = self.game.vote(self.me_id, target)
+        consensus_met = await self.game.vote_async(self.me_id, target)
 
         if self.game.meta['end_on_consensus_met'] and consensus_met:
             self.game.skip_to_twilight()
             self.updater.schedule_update()
 
         # Notify other users about our vote.
+        phase_states = await self.game.get_phase_states_async(self.connections)
+        broadcast = Broadcast()
         for player_id, connections in self.connections.items():
+            update = {
+                'phaseState': phase_states[player_id]
+            }
             for connection in connections:
-                connection.write_message({
-                    'type': 'root',
-                    'body': {
-                        'phaseState': self.game.get_phase_state(player_id)
-                    },
-                    'id': player_id
-                })
+                connection.send_update(update, broadcast)
+        broadcast.report('vote')
 
     def on_will_message(self, body):
         self.game.set_will_for(self.me_id, body)
+        update = {
+            'will': self.game.get_will(self.me_id)
+        }
+        broadcast = Broadcast()
         for connection in self.connections[self.me_id]:
-            connection.write_message({
-                'type': 'root',
-                'body': {
-                    'will': self.game.get_will(self.me_id)
-                },
-                'id': self.me_id
-            })
+            connection.send_update(update, broadcast)
+        broadcast.report('will')
 
-    def on_message(self, msg):
+    async def handle_message(self, msg):
         payload = json.loads(msg)
         body = payload['body']
 
+        admitted = payload['type'] in self.ADMITTED
+        if admitted:
+            retry = self.admission.admit(self.bucket, self.player_bucket)
+            if retry is not None:
+                self.write_message({
+                    'type': 'rej',
+                    'body': payload['seqNum'],
+                    'id': self.me_id,
+                    'retry': round(retry, 3)
+                })
+                return
+
         ok = True
+        queued = started = time.monotonic()
         try:
-            if payload['type'] == 'plan':
-                self.on_plan_message(body)
-            elif payload['type'] == 'vote':
-                self.on_vote_message(body)
-            elif payload['type'] == 'impulse':
-                self.on_impulse_message(body)
-            elif payload['type'] == 'will':
-                self.on_will_message(body)
-            else:
-                ok = False
+            async with self.game.lock:
+                started = time.monotonic()
+                if payload['type'] == 'plan':
+                    await self.on_plan_message(body)
+                elif payload['type'] == 'vote':
+                    await self.on_vote_message(body)
+                elif payload['type'] == 'impulse':
+                    await self.on_impulse_message(body)
+                elif payload['type'] == 'will':
+                    self.on_will_message(body)
+                elif payload['type'] == 'resync':
+                    # The client lost track of our patches, so start it over
+                    # from what we think it has.
+                    self.send_root()
+                else:
+                    ok = False
         except Exception:
             ok = False
             logger.exception('Oops!')
+        finally:
+            if admitted:
+                self.admission.done(started - queued,
+                                    time.monotonic() - started)
 
         self.write_message({
             'type': 'ack' if ok else 'rej',
@@ -205,151 +404,322 @@ class GameSocketHandler(tornado.websocket.WebSocketHandler):
         })
 
 
-class PeekHandler(tornado.web.RequestHandler):
-    def initialize(self, game):
-        self.game = game
+class GameSocketHandler(HostMixin, PlayerConnection,
+                        tornado.websocket.WebSocketHandler):
+    def initialize(self, hosts):
+        super().initialize(hosts)
+        self.init_connection()
 
-    def get(self):
-        token = self.get_argument('token')
-        if not self.game.check_poke_token(token):
-            self.send_error(403)
-            return
+    def is_closed(self):
+        return self.ws_connection is None
 
-        turn = self.get_argument('turn', None)
-        phase = self.get_argument('phase', None)
+    async def open(self, *args):
+        await self.start(self.get_argument('token'))
 
-        if turn is None:
-            raw_plan = self.game.get_current_raw_plan_view()
-        else:
-            raw_plan = self.game.get_raw_plan_view(int(turn), phase)
+    async def on_message(self, msg):
+        await self.handle_message(msg)
 
-        self.set_header('Content-Type', 'text/plain')
-        self.write('\n'.join(
-            self.game.meta['players'][raw_plan[i]['source']]['name'] + ': ' +
-            re.sub(r'\$(\d+)', lambda m: act['targets'][int(m.group(1))],
-                   act['command'])
-            for i, act in enumerate(self.game.interpret_raw_plan_view(raw_plan))
-            if act['targets'] is not None))
+    def on_close(self):
+        self.stop()
 
 
-class PokeHandler(tornado.web.RequestHandler):
-    def initialize(self, game, updater):
-        self.game = game
-        self.updater = updater
+class RootCache(object):
+    """The root state sent to each player on connect, built at most once
+    between changes to the game.
+
+    When a phase ends, every player tends to reconnect at once, so the first
+    miss builds phase states for all players in one go.
+    """
 
-    def get(self):
-        token = self.get_argument('token')
-        if not self.game.check_poke_token(token):
-            self.send_error(403)
+    def __init__(self, game):
+        self.game = game
+        self.phase_states = None
+        self.roots = {}
+        self.game.subscribe(self.on_change)
+
+        self.hits = 0
+        self.misses = 0
+        self.first_messages = 0
+        self.first_message_time = 0
+        self.max_first_message_time = 0
+
+    async def get(self, player_id):
+        """Get the root state for a player, without results, and the encoded
+        body of its root message, with results.
+
+        Callers must hold the game lock.
+        """
+        try:
+            entry = self.roots[player_id]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+
+        if self.phase_states is None:
+            self.phase_states = await self.game.get_phase_states_async(
+                self.game.players)
+
+        root = {
+            'publicState': self.game.get_public_state(),
+            'playerState': self.game.get_player_state(player_id),
+            'publicInfo': self.game.get_public_info(),
+            'phaseState': self.phase_states[player_id],
+            'will': self.game.get_will(player_id),
+        }
+        body = json.dumps(dict(
+            root,
+            nightResults=await self.game.get_night_result_views_async(
+                player_id),
+            dayResults=await self.game.get_day_result_views_async(player_id)
+        )).encode('utf-8')
+
+        entry = self.roots[player_id] = (root, body)
+        return entry
+
+    def on_change(self, change):
+        if change.kind == game.Change.META and change.player_id is not None:
+            # A will only shows up in its own player's root.
+            self.roots.pop(change.player_id, None)
             return
-        self.updater.unschedule_update()
-        self.updater.run()
-        self.finish('ok')
 
+        self.phase_states = None
+        self.roots = {}
+
+    def record_first_message(self, elapsed):
+        self.first_messages += 1
+        self.first_message_time += elapsed
+        self.max_first_message_time = max(self.max_first_message_time,
+                                          elapsed)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'firstMessages': self.first_messages,
+            'meanFirstMessageMs': self.first_message_time * 1000 /
+                                  self.first_messages
+                                  if self.first_messages else None,
+            'maxFirstMessageMs': self.max_first_message_time * 1000
+        }
+
+
+class Broadcast(object):
+    """Sends messages to many connections, building and encoding each distinct
+    message once and writing the same frame to every connection that gets
+    it."""
+
+    def __init__(self):
+        self.memos = {}
+        self.encode_time = 0
+        self.encoded_bytes = 0
+        self.frames = 0
+        self.writes = 0
+
+    def memo(self, key, keep, f):
+        """Get the result of ``f`` for ``key``, calling it only once.
+
+        ``keep`` is held on to for as long as the broadcast, so that object IDs
+        used in ``key`` are not reused.
+        """
+        try:
+            return self.memos[key][1]
+        except KeyError:
+            pass
 
-class ModKillHandler(tornado.web.RequestHandler):
-    def initialize(self, game, updater, connections):
-        self.game = game
-        self.updater = updater
-        self.connections = connections
+        result = f()
+        self.memos[key] = (keep, result)
+        return result
 
-    def get(self):
-        token = self.get_argument('token')
-        if not self.game.check_poke_token(token):
-            self.send_error(403)
-            return
+    def encode(self, message):
+        start = time.monotonic()
+        frame = json.dumps(message).encode('utf-8')
+        self.encode_time += time.monotonic() - start
 
-        self.game.modkill(self.get_argument('target'),
-                          self.get_argument('reason'))
+        self.frames += 1
+        self.encoded_bytes += len(frame)
+        return frame
 
-        if self.game.is_game_over():
-            self.updater.run()
+    def write(self, connection, frame):
+        self.writes += 1
+        connection.write_message(frame)
 
-        # Notify everyone about the modkill.
-        for player_id, connections in self.connections.items():
-            public_state = self.game.get_public_state()
-            phase_state = self.game.get_phase_state(player_id)
-            player_state = self.game.get_player_state(player_id)
+    def report(self, what):
+        if self.writes:
+            logger.info("Broadcast %s: %d frames (%d bytes) encoded in "
+                        "%.2fms, %d writes.", what, self.frames,
+                        self.encoded_bytes, self.encode_time * 1000,
+                        self.writes)
 
-            for connection in connections:
-                connection.write_message({
-                    'type': 'root',
-                    'body': {
-                        'publicState': public_state,
-                        'playerState': player_state,
-                        'phaseState': phase_state
-                    },
-                    'id': player_id
-                })
 
-        self.finish('ok')
+class AdminHandler(tornado.web.RequestHandler):
+    """Runs one of the moderator's requests, ``_peek``, ``_poke``,
+    ``_modkill`` or ``_refresh``, against a game."""
 
+    def initialize(self, hosts, name):
+        self.hosts = hosts
+        self.name = name
 
-class RefreshHandler(tornado.web.RequestHandler):
-    def initialize(self, game, connections):
-        self.game = game
-        self.connections = connections
+    async def get(self, *args):
+        arguments = {name: self.get_argument(name)
+                     for name in self.request.arguments}
 
-    def get(self):
-        token = self.get_argument('token')
-        if not self.game.check_poke_token(token):
-            self.send_error(403)
-            return
-        for player_id, connections in self.connections.items():
-            for connection in connections:
-                connection.write_message({'type': 'refresh', 'id': player_id})
-        self.finish('ok')
+        status, headers, body = await self.hosts.run_admin(
+            self.name, arguments, self.request.headers.get('If-None-Match'),
+            *args)
+
+        self.set_status(status)
+        for name, value in headers.items():
+            self.set_header(name, value)
+        if body:
+            self.write(body)
+        self.finish()
+
+
+def get_argument(arguments, name):
+    try:
+        return arguments[name]
+    except KeyError:
+        raise tornado.web.MissingArgumentError(name)
+
+
+class Scheduler(object):
+    """Runs phase updates for any number of games at their wall-clock times,
+    off a single heap and a single IOLoop timeout.
+
+    Due keys are passed to ``dispatch``.
+    """
+
+    def __init__(self, dispatch):
+        self.dispatch = dispatch
+
+        # (when, seq, key); entries whose seq is no longer current for their
+        # key were superseded and are skipped.
+        self.heap = []
+        self.current = {}
+        self.counter = itertools.count()
+
+        self.handle = None
+        self.ioloop = tornado.ioloop.IOLoop.current()
+
+    def schedule(self, key, when):
+        seq = next(self.counter)
+        self.current[key] = seq
+        heapq.heappush(self.heap, (when, seq, key))
+        self.reset()
 
+    def unschedule(self, key):
+        self.current.pop(key, None)
+
+    def reset(self):
+        while self.heap and self.current.get(self.heap[0][2]) != \
+                            self.heap[0][1]:
+            heapq.heappop(self.heap)
+
+        if self.handle is not None:
+            self.ioloop.remove_timeout(self.handle)
+            self.handle = None
+
+        if self.heap:
+            # IOLoop time is not wall-clock time, so go by the delay.
+            self.handle = self.ioloop.call_later(
+                max(0, self.heap[0][0] - time.time()), self.fire)
+
+    def fire(self):
+        self.handle = None
+
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self.heap)
+            if self.current.get(key) != seq:
+                continue
+            del self.current[key]
+            self.ioloop.spawn_callback(self.dispatch, key)
+
+        self.reset()
 
 
 class Updater(object):
-    def __init__(self, game, connections):
+    def __init__(self, game, connections, roots, scheduler, key):
         self.game = game
         self.connections = connections
-        self.schedule_handle = None
-
-        self.keep_alive_handle = tornado.ioloop.PeriodicCallback(self.keep_alive, 30 * 1000)
-        self.keep_alive_handle.start()
+        self.roots = roots
+        self.scheduler = scheduler
+        self.key = key
 
         self.ioloop = tornado.ioloop.IOLoop.current()
 
-    def run(self):
+    async def run_scheduled(self):
+        async with self.game.lock:
+            if await self.game.is_game_over_async():
+                return
+
+            if time.time() < self.game.meta['schedule']['phase_end']:
+                # The phase end moved since this was scheduled.
+                self.schedule_update()
+                return
+
+            await self.run()
+
+    async def run(self):
+        # Callers must hold the game lock.
         logger.info("Running scheduled update.")
 
         turn = self.game.state['turn']
         phase = self.game.state['phase']
 
-        self.game.finish_phase()
+        await self.game.finish_phase_async()
+        logger.info("Snapshot cache: %s", self.game.snapshot_cache.stats())
+        logger.info("Root cache: %s", self.roots.stats())
+        logger.info("View cache: %s", self.game.views.stats())
+
+        phase_states = await self.game.get_phase_states_async(self.connections)
+
+        results = {}
+        for player_id in list(self.connections):
+            if phase == 'Day':
+                results[player_id] = await self.game.get_day_result_view_async(
+                    turn, player_id)
+            else:
+                results[player_id] = \
+                    await self.game.get_night_result_view_async(turn, player_id)
 
+        public_state = self.game.get_public_state()
+        broadcast = Broadcast()
         for player_id, connections in self.connections.items():
+            phase_end = {
+                'publicState': public_state,
+                'playerState': self.game.get_player_state(player_id),
+                'phaseState': phase_states[player_id],
+                'phase': phase,
+                'result': results[player_id]
+            }
             for connection in connections:
-                connection.write_message({
-                    'type': 'pend',
-                    'body': {
-                        'publicState': self.game.get_public_state(),
-                        'playerState': self.game.get_player_state(player_id),
-                        'phaseState': self.game.get_phase_state(player_id),
-                        'phase': phase,
-                        'result': self.game.get_day_result_view(turn, player_id)
-                                  if phase == 'Day' else
-                                  self.game.get_night_result_view(turn,
-                                                                  player_id)
-                    },
-                    'id': player_id
-                })
+                connection.send_phase_end(phase_end, broadcast)
+        broadcast.report('phase end')
+
+        # Players who are not connected get their result views built in the
+        # background, off the loop.
+        self.ioloop.spawn_callback(self.game.prewarm_result_views_async)
 
         self.schedule_update()
 
     def unschedule_update(self):
-        if self.schedule_handle is not None:
-            self.ioloop.remove_timeout(self.schedule_handle)
-            self.schedule_handle = None
+        self.scheduler.unschedule(self.key)
 
     def schedule_update(self):
         self.unschedule_update()
 
         if self.game.is_game_over():
             logger.info("Game over!")
+            # So that the game isn't loaded on every start just to find this
+            # out again.
+            if not self.game.meta['schedule'].get('game_over'):
+                self.game.meta['schedule']['game_over'] = True
+                self.game.save_meta()
             return
 
         phase_end = self.game.meta['schedule']['phase_end']
@@ -357,54 +727,657 @@ class Updater(object):
         logger.info("Next update in: %s",
                     datetime.timedelta(seconds=phase_end - time.time()))
 
-        self.schedule_handle = self.ioloop.call_at(phase_end, self.run)
+        self.scheduler.schedule(self.key, phase_end)
+
+
+class Host(object):
+    """Everything the server keeps for one loaded game."""
+
+    def __init__(self, game_id, g, scheduler, admission):
+        self.game_id = game_id
+        self.game = g
+        self.connections = {}
+        self.roots = RootCache(g)
+        self.updater = Updater(g, self.connections, self.roots, scheduler,
+                               game_id)
+        self.admission = admission
+        self.player_buckets = {}
+        self.last_used = time.monotonic()
+        self.load = next(LOADS)
+
+        self.updater.schedule_update()
+
+        tornado.ioloop.IOLoop.current().spawn_callback(
+            g.prewarm_result_views_async)
+
+    async def run_admin(self, name, arguments, etag=None):
+        """Run an admin request, returning its status, headers and body."""
+        if not self.game.check_poke_token(get_argument(arguments, 'token')):
+            raise tornado.web.HTTPError(403)
+
+        if name == 'peek':
+            return await self.peek(arguments.get('turn'),
+                                   arguments.get('phase'), etag)
+
+        if name == 'tokens':
+            return 200, {'Content-Type': 'text/plain'}, '\n'.join(
+                '{}: {}'.format(player_name, token)
+                for player_name, token in self.game.get_tokens().items()
+            ).encode('utf-8')
+
+        if name == 'poke':
+            await self.poke()
+        elif name == 'modkill':
+            await self.modkill(get_argument(arguments, 'target'),
+                               get_argument(arguments, 'reason'))
+        elif name == 'refresh':
+            self.refresh()
+        else:
+            raise tornado.web.HTTPError(404)
 
-    def keep_alive(self):
-        for connections in self.connections.values():
+        return 200, {}, b'ok'
+
+    async def peek(self, turn, phase, etag=None):
+        headers = {'Content-Type': 'text/plain'}
+
+        if turn is None:
+            # The current plan only changes with the game.
+            headers['Etag'] = '"{}-{}-{}"'.format(STARTED, self.load,
+                                                  self.game.version)
+            if etag is not None and headers['Etag'] in \
+                    re.findall(r'"[^"]*"', etag):
+                return 304, headers, b''
+            raw_plan = await self.game.get_current_raw_plan_view_async()
+        else:
+            raw_plan = await game.run_in_executor(
+                self.game.get_raw_plan_view, int(turn), phase)
+
+        return 200, headers, '\n'.join(
+            self.game.meta['players'][raw_plan[i]['source']]['name'] + ': ' +
+            re.sub(r'\$(\d+)', lambda m: act['targets'][int(m.group(1))],
+                   act['command'])
+            for i, act in enumerate(self.game.interpret_raw_plan_view(raw_plan))
+            if act['targets'] is not None).encode('utf-8')
+
+    async def poke(self):
+        async with self.game.lock:
+            self.updater.unschedule_update()
+            await self.updater.run()
+
+    async def modkill(self, target, reason):
+        async with self.game.lock:
+            await self.game.modkill_async(target, reason)
+
+            if await self.game.is_game_over_async():
+                await self.updater.run()
+
+            # Notify everyone about the modkill.
+            phase_states = await self.game.get_phase_states_async(
+                self.connections)
+            public_state = self.game.get_public_state()
+            broadcast = Broadcast()
+            for player_id, connections in self.connections.items():
+                update = {
+                    'publicState': public_state,
+                    'playerState': self.game.get_player_state(player_id),
+                    'phaseState': phase_states[player_id]
+                }
+                for connection in connections:
+                    connection.send_update(update, broadcast)
+            broadcast.report('modkill')
+
+    def refresh(self):
+        broadcast = Broadcast()
+        for player_id, connections in self.connections.items():
+            frame = broadcast.encode({'type': 'refresh', 'id': player_id})
             for connection in connections:
-                connection.ping(b'')
+                broadcast.write(connection, frame)
+        broadcast.report('refresh')
+
+    def is_idle(self):
+        return not any(self.connections.values()) and \
+               not self.game.lock.locked()
+
+    def close(self):
+        self.game.flush()
+        self.game.storage.close()
+
+
+class Games(object):
+    """Where the games served are, by ID.
+
+    With ``games_path``, each directory in it holding a game is served under
+    its name. Otherwise the single game at ``game_path`` is served, with an ID
+    of ``None``.
+    """
+
+    def __init__(self, game_path=None, games_path=None):
+        self.game_path = game_path
+        self.games_path = games_path
+
+    def get_path(self, game_id=None):
+        if self.games_path is None:
+            if game_id is not None:
+                raise KeyError(game_id)
+            return self.game_path
+
+        if game_id is None or not GAME_ID_RE.match(game_id):
+            raise KeyError(game_id)
+
+        path = os.path.join(self.games_path, game_id)
+        if not os.path.isfile(os.path.join(path, 'meta.yml')) and \
+           not os.path.isfile(os.path.join(path, storage.DB_NAME)):
+            raise KeyError(game_id)
+        return path
+
 
+class Hosts(Games):
+    """The games served by this process.
 
-def make_app():
-    g = game.Game(tornado.options.options.game_path)
+    When there are many, games are loaded on first use and unloaded again
+    once idle.
+    """
 
-    logger.info('Poke token: %s', g.make_poke_token())
+    def __init__(self, game_path=None, games_path=None, idle_timeout=None,
+                 backend=None, fast_start=False, admission=None):
+        super().__init__(game_path, games_path)
+        self.idle_timeout = idle_timeout
+        self.backend = backend
+        self.fast_start = fast_start
+        self.admission = admission
 
-    logger.info('Tokens:\n%s', '\n'.join(
-        '%10s: %s' % (name, token)
-        for name, token in g.get_tokens().items()))
+        self.hosts = {}
+        self.loading = {}
+        self.scheduler = Scheduler(self.run_scheduled)
 
-    g.start()
+        self.keep_alive_handle = tornado.ioloop.PeriodicCallback(
+            self.keep_alive, 30 * 1000)
+        self.keep_alive_handle.start()
+
+        self.report_handle = tornado.ioloop.PeriodicCallback(
+            self.report_admission, 60 * 1000)
+        self.report_handle.start()
+
+        if self.games_path is not None and self.idle_timeout:
+            self.evict_handle = tornado.ioloop.PeriodicCallback(
+                self.evict_idle, min(self.idle_timeout, 60) * 1000)
+            self.evict_handle.start()
+
+    def discover(self):
+        """Schedule the phase ends of every game, without loading them."""
+        for game_id in sorted(os.listdir(self.games_path)):
+            try:
+                path = self.get_path(game_id)
+            except KeyError:
+                continue
+
+            games = storage.open_storage(path, self.backend)
+            try:
+                schedule = games.load_meta()['schedule']
+            finally:
+                games.close()
+
+            if schedule['phase_end'] is not None and \
+               not schedule.get('game_over'):
+                self.scheduler.schedule(game_id, schedule['phase_end'])
+
+    def open_game(self, game_id, path):
+        g = game.Game(path, self.backend, game.Profile())
+
+        logger.info('Poke token for %s: %s', game_id or path,
+                    g.make_poke_token())
+
+        if not self.fast_start:
+            with g.profile.stage('tokens'):
+                logger.info('Tokens for %s:\n%s', game_id or path,
+                            '\n'.join('%10s: %s' % (name, token)
+                                      for name, token
+                                      in g.get_tokens().items()))
+
+        with g.profile.stage('start'):
+            g.start()
+
+        # Hosts schedule the next phase end as soon as they are made, which
+        # needs the winners, so work them out here rather than on the loop.
+        with g.profile.stage('view-winners'):
+            g.get_raw_winners()
+        return g
+
+    def add(self, game_id, g):
+        host = self.hosts[game_id] = Host(game_id, g, self.scheduler,
+                                               self.admission)
+
+        if self.fast_start:
+            tornado.ioloop.IOLoop.current().spawn_callback(self.warm, host)
+        else:
+            logger.info("Startup profile for %s: %s",
+                        game_id or self.game_path, g.profile.report())
+        return host
+
+    async def warm(self, host):
+        """Build every player's root ahead of their first connection."""
+        with host.game.profile.stage('warm'):
+            for player_id in list(host.game.players):
+                # Take the lock a player at a time, so that connections opened
+                # meanwhile only wait for one root to be built.
+                async with host.game.lock:
+                    await host.roots.get(player_id)
+
+        logger.info("Startup profile for %s: %s",
+                    host.game_id or self.game_path, host.game.profile.report())
+
+    def load_now(self, game_id=None):
+        return self.add(game_id, self.open_game(game_id,
+                                                self.get_path(game_id)))
+
+    async def load(self, game_id):
+        try:
+            g = await game.run_in_executor(self.open_game, game_id,
+                                           self.get_path(game_id))
+            host = self.add(game_id, g)
+            logger.info("Loaded game: %s", game_id)
+            return host
+        finally:
+            del self.loading[game_id]
+
+    async def get(self, game_id=None):
+        host = self.hosts.get(game_id)
+
+        if host is None:
+            self.get_path(game_id)
+
+            # Everyone asking for a game while it loads waits on the same load.
+            future = self.loading.get(game_id)
+            if future is None:
+                future = self.loading[game_id] = asyncio.ensure_future(
+                    self.load(game_id))
+            host = await asyncio.shield(future)
+
+        host.last_used = time.monotonic()
+        return host
+
+    async def run_admin(self, name, arguments, etag=None, game_id=None):
+        try:
+            host = await self.get(game_id)
+        except KeyError:
+            raise tornado.web.HTTPError(404)
+
+        return await host.run_admin(name, arguments, etag)
+
+    async def run_scheduled(self, game_id):
+        try:
+            host = await self.get(game_id)
+        except KeyError:
+            logger.warning("Scheduled game went away: %s", game_id)
+            return
+
+        await host.updater.run_scheduled()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for game_id, host in list(self.hosts.items()):
+            if host.is_idle() and now - host.last_used > self.idle_timeout:
+                logger.info("Unloading idle game: %s", game_id)
+                del self.hosts[game_id]
+                host.close()
+
+    def keep_alive(self):
+        for host in self.hosts.values():
+            for connections in host.connections.values():
+                for connection in connections:
+                    connection.ping(b'')
+
+    def report_admission(self):
+        stats = self.admission.report()
+        if stats is not None:
+            logger.info("Admission: %s", stats)
+
+    def flush(self):
+        for host in self.hosts.values():
+            host.game.flush()
+
+
+class RemoteConnection(PlayerConnection):
+    """A player's socket held by another server process, reached over the
+    bus."""
+
+    def __init__(self, peer, conn):
+        self.peer = peer
+        self.conn = conn
+        self.closed = False
+        self.init_connection()
+
+        # Messages are handled one at a time and in order, as they are for
+        # our own sockets.
+        self.lock = asyncio.Lock()
+
+    def is_closed(self):
+        return self.closed
+
+    def write_message(self, message):
+        if isinstance(message, dict):
+            message = json.dumps(message).encode('utf-8')
+        self.peer.send_frame(self.conn, message)
+
+    def ping(self, data):
+        self.peer.send({'op': 'ping', 'conn': self.conn})
+
+    def close(self, code=None, reason=None):
+        self.closed = True
+        self.peer.send({'op': 'close', 'conn': self.conn, 'code': code,
+                        'reason': reason})
+
+    async def open(self, hosts, game_id, token):
+        async with self.lock:
+            try:
+                host = await hosts.get(game_id)
+            except KeyError:
+                self.close(4004, "No such game.")
+                return
+
+            self.game = host.game
+            self.connections = host.connections
+            self.updater = host.updater
+            self.roots = host.roots
+            self.admission = host.admission
+            self.player_buckets = host.player_buckets
+
+            await self.start(token)
+
+    async def receive(self, msg):
+        async with self.lock:
+            if self.me_id is not None and not self.closed:
+                await self.handle_message(msg)
+
+    async def on_close(self):
+        self.closed = True
+        async with self.lock:
+            self.stop()
+
+
+class Hub(object):
+    """Serves the sockets and admin requests of other server processes from
+    the process that owns the games."""
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.server = bus.Server(self.on_connect, self.on_message,
+                                 self.on_disconnect)
+
+        # (peer, connection ID) -> RemoteConnection
+        self.remotes = {}
+
+        self.ioloop = tornado.ioloop.IOLoop.current()
+
+    def add_socket(self, sock):
+        self.server.add_socket(sock)
+
+    def on_connect(self, peer):
+        logger.info("Worker connected to the bus.")
+
+    def on_disconnect(self, peer):
+        logger.warning("Worker left the bus.")
+        for key in [key for key in self.remotes if key[0] is peer]:
+            self.ioloop.spawn_callback(self.remotes.pop(key).on_close)
+
+    def on_message(self, peer, header, payload):
+        op = header['op']
+
+        if op == 'open':
+            remote = self.remotes[peer, header['conn']] = \
+                RemoteConnection(peer, header['conn'])
+            self.ioloop.spawn_callback(remote.open, self.hosts,
+                                       header['game'], header['token'])
+        elif op == 'message':
+            remote = self.remotes.get((peer, header['conn']))
+            if remote is not None:
+                self.ioloop.spawn_callback(remote.receive, payload)
+        elif op == 'close':
+            remote = self.remotes.pop((peer, header['conn']), None)
+            if remote is not None:
+                self.ioloop.spawn_callback(remote.on_close)
+        elif op == 'request':
+            self.ioloop.spawn_callback(self.run_admin, peer, header)
+
+    async def run_admin(self, peer, header):
+        try:
+            status, headers, body = await self.hosts.run_admin(
+                header['name'], header['arguments'], header['etag'],
+                header['game'])
+        except tornado.web.HTTPError as e:
+            status, headers, body = e.status_code, None, b''
+        except Exception:
+            logger.exception('Oops!')
+            status, headers, body = 500, None, b''
+
+        peer.send({'op': 'response', 'id': header['id'], 'status': status,
+                   'headers': headers}, body)
+
+
+class Relay(Games):
+    """Passes the sockets and admin requests of this process on to the process
+    that owns the games, over the bus."""
+
+    def __init__(self, path, game_path=None, games_path=None):
+        super().__init__(game_path, games_path)
+        self.path = path
+        self.peer = None
 
-    connections = {}
+        # connection ID -> RelaySocketHandler
+        self.sockets = {}
+        # request ID -> future of (status, headers, body)
+        self.requests = {}
+        self.counter = itertools.count()
 
-    updater = Updater(g, connections)
-    updater.schedule_update()
+    async def run(self):
+        while True:
+            try:
+                self.peer = await bus.connect(self.path, self.on_message)
+            except (OSError, tornado.iostream.StreamClosedError):
+                await asyncio.sleep(1)
+                continue
+
+            logger.info("Connected to the bus.")
+            await self.peer.run()
+            self.peer = None
+            logger.warning("Lost the bus, dropping relayed sockets.")
+
+            for socket in list(self.sockets.values()):
+                socket.close(1012, "Server restarting.")
+            self.sockets = {}
+
+            for future in self.requests.values():
+                future.set_exception(tornado.web.HTTPError(503))
+            self.requests = {}
+
+    def open(self, socket, game_id, token):
+        if self.peer is None:
+            socket.close(1013, "Try again later.")
+            return None
+
+        conn = next(self.counter)
+        self.sockets[conn] = socket
+        self.peer.send({'op': 'open', 'conn': conn, 'game': game_id,
+                        'token': token})
+        return conn
+
+    def send_message(self, conn, msg):
+        if self.peer is not None and conn in self.sockets:
+            self.peer.send({'op': 'message', 'conn': conn},
+                           msg.encode('utf-8'))
+
+    def close(self, conn):
+        if self.sockets.pop(conn, None) is not None and self.peer is not None:
+            self.peer.send({'op': 'close', 'conn': conn})
+
+    async def run_admin(self, name, arguments, etag=None, game_id=None):
+        if self.peer is None:
+            raise tornado.web.HTTPError(503)
+
+        request_id = next(self.counter)
+        future = self.requests[request_id] = asyncio.Future()
+        self.peer.send({'op': 'request', 'id': request_id, 'game': game_id,
+                        'name': name, 'arguments': arguments, 'etag': etag})
+
+        status, headers, body = await future
+        if headers is None:
+            raise tornado.web.HTTPError(status)
+        return status, headers, body
+
+    def on_message(self, peer, header, payload):
+        op = header['op']
+
+        if op == 'frame':
+            for conn in header['conns']:
+                socket = self.sockets.get(conn)
+                if socket is not None:
+                    socket.write_message(payload)
+        elif op == 'ping':
+            socket = self.sockets.get(header['conn'])
+            if socket is not None:
+                socket.ping(b'')
+        elif op == 'close':
+            # The socket's on_close lets the owner know it is gone.
+            socket = self.sockets.get(header['conn'])
+            if socket is not None:
+                socket.close(header['code'], header['reason'])
+        elif op == 'response':
+            future = self.requests.pop(header['id'], None)
+            if future is not None:
+                future.set_result((header['status'], header['headers'],
+                                   payload))
+
+
+class RelaySocketHandler(tornado.websocket.WebSocketHandler):
+    def initialize(self, relay):
+        self.relay = relay
+        self.conn = None
+
+    def open(self, *args):
+        self.conn = self.relay.open(self, args[0] if args else None,
+                                    self.get_argument('token'))
+
+    def on_message(self, msg):
+        self.relay.send_message(self.conn, msg)
+
+    def on_close(self):
+        if self.conn is not None:
+            self.relay.close(self.conn)
+
+
+def make_app(relay=None):
+    options = tornado.options.options
+
+    limits = admission.Admission(
+        options.message_rate, options.message_burst,
+        options.player_message_rate, options.player_message_burst,
+        options.max_pending_messages)
+
+    if relay is not None:
+        hosts = relay
+        socket_handler = RelaySocketHandler, {'relay': relay}
+    elif options.games_path is None:
+        hosts = Hosts(game_path=options.game_path, backend=options.storage,
+                      fast_start=options.fast_start, admission=limits)
+        if options.fast_start:
+            # Requests that come in first wait for this same load.
+            tornado.ioloop.IOLoop.current().spawn_callback(hosts.get)
+        else:
+            hosts.load_now()
+        socket_handler = GameSocketHandler, {'hosts': hosts}
+    else:
+        hosts = Hosts(games_path=options.games_path,
+                      idle_timeout=options.game_idle_timeout,
+                      backend=options.storage, fast_start=options.fast_start,
+                      admission=limits)
+        hosts.discover()
+        socket_handler = GameSocketHandler, {'hosts': hosts}
+
+    if options.games_path is None:
+        prefix = static_prefix = ''
+    else:
+        prefix = r'/g/([\w-]+)'
+        static_prefix = r'/g/[\w-]+'
+
+    static_path = os.path.join(os.path.dirname(__file__), 'static')
 
     return tornado.web.Application([
-        (r'/', MainHandler),
-        (r'/_modkill', ModKillHandler, {'game': g, 'updater': updater,
-                                        'connections': connections}),
-        (r'/_peek', PeekHandler, {'game': g}),
-        (r'/_poke', PokeHandler, {'game': g, 'updater': updater}),
-        (r'/_refresh', RefreshHandler, {'game': g, 'connections': connections}),
-        (r'/ws', GameSocketHandler, {'game': g, 'connections': connections,
-                                     'updater': updater}),
-        (r'/static/(.*)', tornado.web.StaticFileHandler, {'path': os.path.join(
-            os.path.dirname(__file__), 'static')}),
-    ], debug=tornado.options.options.debug, template_path=os.path.join(
-        os.path.dirname(__file__), 'templates'))
+        (prefix + r'/?', MainHandler, {'hosts': hosts}),
+        (prefix + r'/_modkill', AdminHandler,
+         {'hosts': hosts, 'name': 'modkill'}),
+        (prefix + r'/_peek', AdminHandler, {'hosts': hosts, 'name': 'peek'}),
+        (prefix + r'/_poke', AdminHandler, {'hosts': hosts, 'name': 'poke'}),
+        (prefix + r'/_refresh', AdminHandler,
+         {'hosts': hosts, 'name': 'refresh'}),
+        (prefix + r'/_tokens', AdminHandler,
+         {'hosts': hosts, 'name': 'tokens'}),
+        (prefix + r'/ws',) + socket_handler,
+        (static_prefix + r'/static/(.*)', tornado.web.StaticFileHandler,
+         {'path': static_path}),
+    ], debug=options.debug, template_path=os.path.join(
+        os.path.dirname(__file__), 'templates'), hosts=hosts)
 
 
 def main():
+    global STARTED
+
     tornado.options.parse_command_line()
+    options = tornado.options.options
+
+    profile = game.Profile()
 
-    app = make_app()
-    app.listen(tornado.options.options.listen_port,
-               tornado.options.options.listen_host)
-    logger.info("Listening: %s:%d", tornado.options.options.listen_host,
-                tornado.options.options.listen_port)
-    tornado.ioloop.IOLoop.current().start()
+    if options.server_workers <= 1:
+        with profile.stage('glue'):
+            glue.start_pool(options.glue_workers)
+
+        with profile.stage('app'):
+            app = make_app()
+        app.listen(options.listen_port, options.listen_host)
+        logger.info("Listening: %s:%d (%s)", options.listen_host,
+                    options.listen_port, profile.report())
+        try:
+            tornado.ioloop.IOLoop.current().start()
+        finally:
+            app.settings['hosts'].flush()
+        return
+
+    # Every worker accepts connections on the same listening socket. The
+    # first owns the games and serves the rest over the bus.
+    sockets = tornado.netutil.bind_sockets(options.listen_port,
+                                           options.listen_host)
+    bus_path = options.bus_path or os.path.join(
+        tempfile.gettempdir(), 'padrino-{}.sock'.format(options.listen_port))
+    bus_socket = tornado.netutil.bind_unix_socket(bus_path)
+
+    task_id = tornado.process.fork_processes(options.server_workers)
+
+    if task_id == 0:
+        # The owner may be a restart, with game versions starting over.
+        STARTED = int(time.time())
+
+        with profile.stage('glue'):
+            glue.start_pool(options.glue_workers)
+
+        with profile.stage('app'):
+            app = make_app()
+        Hub(app.settings['hosts']).add_socket(bus_socket)
+    else:
+        bus_socket.close()
+
+        relay = Relay(bus_path, options.game_path, options.games_path)
+        tornado.ioloop.IOLoop.current().spawn_callback(relay.run)
+        with profile.stage('app'):
+            app = make_app(relay)
+
+    server = tornado.httpserver.HTTPServer(app)
+    server.add_sockets(sockets)
+    logger.info("Worker %d listening: %s:%d (%s)", task_id,
+                options.listen_host, options.listen_port, profile.report())
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    finally:
+        if task_id == 0:
+            app.settings['hosts'].flush()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,234 @@
+"""An append-only archive of per-phase game files.
+
+Each finished phase leaves behind a copy of the state, plan, actions and
+ballot files it used. Rather than keeping these as loose files, the
+``SnapshotStore`` packs them into a single file. Each record is compressed
+with zlib, using the previous record of the same kind as a preset
+dictionary, so consecutive near-identical states only cost their
+differences. Records are found through an in-memory index by kind, phase and
+turn, and are read out of a memory map of the pack.
+
+glue still wants paths, so records can be materialized back into files on
+demand.
+"""
+
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+# Every this many records of a kind, one is stored without a preset
+# dictionary, so reading any record only has to decompress a short chain.
+MAX_CHAIN = 8
+
+_HEADER = struct.Struct('>HHI')
+
+SNAPSHOT_NAME_RE = re.compile(
+    r'^(?P<kind>state|plan|actions|ballot)\.yml\.(?P<phase>night|day)\.'
+    r'(?P<turn>\d+)$')
+
+
+def make_key(kind, phase, turn):
+    return '{}:{}:{}'.format(kind, phase, turn)
+
+
+def get_file_name(kind, phase, turn):
+    return '{}.yml.{}.{}'.format(kind, phase, turn)
+
+
+def drop_torn_tail(path, end):
+    """Truncate an append-only file to the ``end`` of its last whole record.
+
+    A torn write at the end (from a crash partway through an append) is
+    simply dropped, so that the next append is not lost behind it.
+    """
+    if os.path.getsize(path) > end:
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+
+
+class Snapshots(object):
+    """What every snapshot store provides on top of ``put``, ``get``, ``keys``
+    and ``__contains__``."""
+
+    def put_file(self, kind, phase, turn, path):
+        with open(path, 'rb') as f:
+            self.put(kind, phase, turn, f.read())
+
+    def materialize(self, kind, phase, turn, path):
+        """Write a snapshot out to ``path`` unless it is already there."""
+        if os.path.exists(path):
+            return path
+
+        data = self.get(kind, phase, turn)
+        tmp_path = '{}.tmp.{}'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def import_files(self):
+        """Store any loose snapshot files that are not in the store yet.
+
+        Files are added in game order, so that deltas line up.
+        """
+        found = []
+        for name in os.listdir(self.root):
+            match = SNAPSHOT_NAME_RE.match(name)
+            if match is None:
+                continue
+            kind = match.group('kind')
+            phase = match.group('phase')
+            turn = int(match.group('turn'))
+            if (kind, phase, turn) not in self:
+                found.append((turn, phase == 'day', kind, phase))
+
+        for turn, _, kind, phase in sorted(found):
+            self.put_file(kind, phase, turn, os.path.join(
+                self.root, get_file_name(kind, phase, turn)))
+
+        return len(found)
+
+    def export_files(self, directory):
+        """Write out every snapshot glue reads as a loose file."""
+        for kind, phase, turn in self.keys():
+            name = get_file_name(kind, phase, turn)
+            if SNAPSHOT_NAME_RE.match(name) is not None:
+                self.materialize(kind, phase, turn,
+                                 os.path.join(directory, name))
+
+    def prune_files(self, keep=()):
+        """Remove materialized files for stored snapshots, except ``keep``."""
+        keep = set(keep)
+        for kind, phase, turn in self.keys():
+            if (kind, phase, turn) in keep:
+                continue
+            try:
+                os.remove(os.path.join(self.root,
+                                       get_file_name(kind, phase, turn)))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        pass
+
+
+class SnapshotStore(Snapshots):
+    def __init__(self, root):
+        self.root = root
+        self.pack_path = os.path.join(root, 'snapshots.pack')
+
+        self.lock = threading.RLock()
+
+        # key -> (offset, length, base key, chain length)
+        self.index = {}
+        # kind -> last key stored for that kind
+        self.last = {}
+
+        self.map = None
+
+        if not os.path.exists(self.pack_path):
+            open(self.pack_path, 'wb').close()
+
+        self.load_index()
+
+    def load_index(self):
+        size = os.path.getsize(self.pack_path)
+        end = 0
+
+        with open(self.pack_path, 'rb') as f:
+            while end < size:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+
+                key_len, base_len, length = _HEADER.unpack(header)
+                offset = end + _HEADER.size + key_len + base_len
+                if offset + length > size:
+                    break
+
+                key = f.read(key_len).decode('utf-8')
+                base = f.read(base_len).decode('utf-8') or None
+                f.seek(length, os.SEEK_CUR)
+
+                self.add_to_index(key, offset, length, base)
+                end = offset + length
+
+        drop_torn_tail(self.pack_path, end)
+        self.remap()
+
+    def add_to_index(self, key, offset, length, base):
+        chain = 0 if base is None else self.index[base][3] + 1
+        self.index[key] = (offset, length, base, chain)
+        self.last[key.split(':', 1)[0]] = key
+
+    def remap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+        if os.path.getsize(self.pack_path) > 0:
+            with open(self.pack_path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, key):
+        return make_key(*key) in self.index
+
+    def keys(self):
+        with self.lock:
+            return [(kind, phase, int(turn))
+                    for kind, phase, turn in (key.split(':')
+                                              for key in self.index)]
+
+    def put(self, kind, phase, turn, data):
+        key = make_key(kind, phase, turn)
+
+        with self.lock:
+            if key in self.index:
+                raise ValueError('snapshot already stored: {}'.format(key))
+
+            base = self.last.get(kind)
+            if base is not None and self.index[base][3] + 1 >= MAX_CHAIN:
+                base = None
+
+            if base is not None:
+                compressor = zlib.compressobj(zdict=self.read(base))
+            else:
+                compressor = zlib.compressobj()
+            payload = compressor.compress(data) + compressor.flush()
+
+            raw_key = key.encode('utf-8')
+            raw_base = base.encode('utf-8') if base is not None else b''
+
+            with open(self.pack_path, 'ab') as f:
+                offset = f.tell() + _HEADER.size + len(raw_key) + len(raw_base)
+                f.write(_HEADER.pack(len(raw_key), len(raw_base),
+                                     len(payload)) + raw_key + raw_base +
+                        payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.add_to_index(key, offset, len(payload), base)
+            self.remap()
+
+    def read(self, key):
+        offset, length, base, _ = self.index[key]
+
+        if base is not None:
+            decompressor = zlib.decompressobj(zdict=self.read(base))
+        else:
+            decompressor = zlib.decompressobj()
+        return decompressor.decompress(self.map[offset:offset + length]) + \
+               decompressor.flush()
+
+    def get(self, kind, phase, turn):
+        with self.lock:
+            return self.read(make_key(kind, phase, turn))
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
@@ -0,0 +1,441 @@
+"""Where a game keeps its meta and the snapshots of finished phases.
+
+Meta is split in two. The roster, actions, factions and secret never change
+once a game is built, and are only written when it is created or imported.
+The schedule and wills change all the time, and are all that is written
+while a game runs.
+
+``FileStorage`` is the original layout: ``meta.yml`` next to the state, with
+the schedule and wills kept over it in ``meta.hot.yml``, and snapshots in
+``snapshots.pack``. Changes to the schedule and wills are appended to
+``meta.hot.log``, one line each, so a changed will costs about its own
+size. Once the log grows past ``MAX_HOT_LOG`` bytes, it is folded back into
+``meta.hot.yml``. ``SQLiteStorage`` keeps all of these in ``game.db``
+instead. There, the schedule and each player's will are rows of their own
+and snapshots (including the plans and ballots of each phase) are blobs
+keyed by kind, turn and phase. A changed will then costs one row.
+
+Either way, the live state, plan, actions and ballot files stay loose, since
+glue reads and rewrites them in place, and snapshots are written out as files
+when glue needs them. ``export`` writes out the whole file layout from any
+storage::
+
+    python -m padrino.storage export <game path> [<directory>]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import urllib.parse
+import zlib
+
+from padrino import codec
+from padrino import snapshots
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = 'game.db'
+
+# How large meta.hot.log may grow before it is folded into meta.hot.yml.
+MAX_HOT_LOG = 64 * 1024
+
+
+def get_hot_meta(meta):
+    """Get the parts of meta that change while a game runs."""
+    return {
+        'schedule': dict(meta['schedule']),
+        'wills': {player_id: player['will']
+                  for player_id, player in meta['players'].items()}
+    }
+
+
+def get_cold_meta(meta):
+    """Get the parts of meta that never change once a game is built."""
+    cold = {key: value for key, value in meta.items() if key != 'schedule'}
+    cold['players'] = {
+        player_id: {key: value for key, value in player.items()
+                    if key != 'will'}
+        for player_id, player in meta['players'].items()
+    }
+    return cold
+
+
+def apply_hot_meta(meta, hot):
+    if 'schedule' in hot:
+        meta['schedule'] = hot['schedule']
+    for player_id, will in hot.get('wills', {}).items():
+        meta['players'][player_id]['will'] = will
+    return meta
+
+
+def load_meta_files(root):
+    """Read meta kept in files. Nothing is written, so this is safe to do
+    while a server has the game open."""
+    with open(os.path.join(root, 'meta.yml'), 'r') as f:
+        meta = codec.load_yaml(f)
+
+    try:
+        with open(os.path.join(root, 'meta.hot.yml'), 'r') as f:
+            apply_hot_meta(meta, codec.load_yaml(f))
+    except FileNotFoundError:
+        pass
+
+    changes, _ = read_hot_log(os.path.join(root, 'meta.hot.log'))
+    for change in changes:
+        apply_hot_change(meta, change)
+    return meta
+
+
+def read_hot_log(path):
+    """Read the changes in a meta.hot.log, and how many bytes of it they
+    take. Anything after that is a torn write."""
+    changes = []
+    end = 0
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    changes.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    break
+                end += len(line)
+    except FileNotFoundError:
+        pass
+    return changes, end
+
+
+def apply_hot_change(meta, change):
+    """Apply a line of meta.hot.log. IDs are kept out of JSON object keys,
+    which can only be strings."""
+    if 'schedule' in change:
+        meta['schedule'] = change['schedule']
+    if 'will' in change:
+        player_id, will = change['will']
+        meta['players'][player_id]['will'] = will
+
+
+class WrittenHotMeta(object):
+    """The schedule and wills a storage last wrote, so that only what changed
+    is written again."""
+
+    def __init__(self):
+        self.schedule = None
+        self.wills = {}
+
+    def changes(self, schedule, wills):
+        """Whether the schedule changed, and the wills that did, as
+        ``(player_id, will)`` pairs."""
+        return (schedule != self.schedule,
+                [(player_id, will) for player_id, will in wills.items()
+                 if self.wills.get(player_id) != will])
+
+    def update(self, schedule, wills):
+        self.schedule = schedule
+        self.wills = wills
+
+
+class FileStorage(object):
+    name = 'files'
+
+    def __init__(self, root):
+        self.root = root
+        self.hot_meta_path = os.path.join(root, 'meta.hot.yml')
+        self.hot_log_path = os.path.join(root, 'meta.hot.log')
+        self.snapshots = snapshots.SnapshotStore(root)
+
+        self.written = WrittenHotMeta()
+
+    def load_meta(self):
+        if os.path.exists(self.hot_log_path):
+            _, end = read_hot_log(self.hot_log_path)
+            snapshots.drop_torn_tail(self.hot_log_path, end)
+
+        meta = load_meta_files(self.root)
+        self.written.update(*self.dump_meta(meta))
+        return meta
+
+    def dump_meta(self, meta):
+        """Copy out the hot parts of meta for ``write_meta``.
+
+        This is called wherever meta is consistent, so that ``write_meta``
+        can run on another thread.
+        """
+        hot = get_hot_meta(meta)
+        return hot['schedule'], hot['wills']
+
+    def write_meta(self, raw):
+        schedule, wills = raw
+
+        schedule_changed, changed_wills = self.written.changes(schedule, wills)
+        changes = [{'will': [player_id, will]}
+                   for player_id, will in changed_wills]
+        if schedule_changed:
+            changes.insert(0, {'schedule': schedule})
+        if not changes:
+            return
+
+        with open(self.hot_log_path, 'a') as f:
+            f.write(''.join(json.dumps(change) + '\n' for change in changes))
+            size = f.tell()
+
+        self.written.update(schedule, wills)
+
+        if size > MAX_HOT_LOG:
+            self.compact_meta(schedule, wills)
+
+    def compact_meta(self, schedule, wills):
+        """Fold the log into meta.hot.yml.
+
+        Replaying the log over the new meta.hot.yml changes nothing, so a
+        crash before the log is removed loses nothing either.
+        """
+        tmp_path = self.hot_meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            codec.dump_yaml({'schedule': schedule, 'wills': wills}, f,
+                            default_flow_style=False)
+        os.replace(tmp_path, self.hot_meta_path)
+        os.remove(self.hot_log_path)
+
+    def export(self, directory):
+        with open(os.path.join(directory, 'meta.yml'), 'w') as f:
+            codec.dump_yaml(self.load_meta(), f, default_flow_style=False)
+        self.snapshots.export_files(directory)
+
+    def close(self):
+        self.snapshots.close()
+
+
+class SQLiteSnapshots(snapshots.Snapshots):
+    def __init__(self, root, db, lock):
+        self.root = root
+        self.db = db
+        self.lock = lock
+
+        with self.lock:
+            self.index = set(self.db.execute(
+                'SELECT kind, phase, turn FROM snapshots'))
+
+    def __contains__(self, key):
+        return tuple(key) in self.index
+
+    def keys(self):
+        with self.lock:
+            return list(self.index)
+
+    def put(self, kind, phase, turn, data):
+        with self.lock:
+            if (kind, phase, turn) in self.index:
+                raise ValueError('snapshot already stored: {}'.format(
+                    snapshots.make_key(kind, phase, turn)))
+
+            with self.db:
+                self.db.execute(
+                    'INSERT INTO snapshots (kind, phase, turn, data) '
+                    'VALUES (?, ?, ?, ?)',
+                    (kind, phase, turn, zlib.compress(data)))
+            self.index.add((kind, phase, turn))
+
+    def get(self, kind, phase, turn):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT data FROM snapshots '
+                'WHERE kind = ? AND turn = ? AND phase = ?',
+                (kind, turn, phase)).fetchone()
+        if row is None:
+            raise KeyError(snapshots.make_key(kind, phase, turn))
+        return zlib.decompress(row[0])
+
+
+class SQLiteStorage(object):
+    name = 'sqlite'
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS meta (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS schedule (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS wills (
+            player_id INTEGER PRIMARY KEY,
+            will TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS snapshots (
+            kind TEXT NOT NULL,
+            turn INTEGER NOT NULL,
+            phase TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (kind, turn, phase)
+        );
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self.db_path = os.path.join(root, DB_NAME)
+
+        # Used from the IOLoop and executor threads alike, one at a time.
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(self.SCHEMA)
+
+        self.snapshots = SQLiteSnapshots(root, self.db, self.lock)
+
+        self.written = WrittenHotMeta()
+
+        with self.lock:
+            row = self.db.execute('SELECT data FROM meta').fetchone()
+        if row is None:
+            self.import_files()
+
+    def import_files(self):
+        """Move a game kept in files into the database."""
+        meta = load_meta_files(self.root)
+
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO meta (id, data) VALUES (0, ?)',
+                (codec.dump_yaml(get_cold_meta(meta)),))
+        self.write_meta(self.dump_meta(meta))
+
+        if os.path.exists(os.path.join(self.root, 'snapshots.pack')):
+            pack = snapshots.SnapshotStore(self.root)
+            try:
+                for kind, phase, turn in pack.keys():
+                    if (kind, phase, turn) not in self.snapshots:
+                        self.snapshots.put(kind, phase, turn,
+                                           pack.get(kind, phase, turn))
+            finally:
+                pack.close()
+
+        logger.info("Imported %s into %s; meta.yml, meta.hot.yml, "
+                    "meta.hot.log and snapshots.pack are no longer used.",
+                    self.root, DB_NAME)
+
+    def load_meta(self):
+        with self.lock:
+            meta = load_meta_db(self.db)
+
+        self.written.update(*self.dump_meta(meta))
+        return meta
+
+    def dump_meta(self, meta):
+        hot = get_hot_meta(meta)
+        return codec.dump_yaml(hot['schedule']), hot['wills']
+
+    def write_meta(self, raw):
+        schedule, wills = raw
+
+        with self.lock:
+            schedule_changed, changed_wills = self.written.changes(schedule,
+                                                                   wills)
+            if not schedule_changed and not changed_wills:
+                return
+
+            with self.db:
+                if schedule_changed:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO schedule (id, data) '
+                        'VALUES (0, ?)', (schedule,))
+                if changed_wills:
+                    self.db.executemany(
+                        'INSERT OR REPLACE INTO wills (player_id, will) '
+                        'VALUES (?, ?)', changed_wills)
+
+            self.written.update(schedule, wills)
+
+    def export(self, directory):
+        with open(os.path.join(directory, 'meta.yml'), 'w') as f:
+            codec.dump_yaml(self.load_meta(), f, default_flow_style=False)
+        self.snapshots.export_files(directory)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def load_meta_db(db):
+    data, = db.execute('SELECT data FROM meta').fetchone()
+    row = db.execute('SELECT data FROM schedule').fetchone()
+    wills = dict(db.execute('SELECT player_id, will FROM wills'))
+
+    meta = codec.load_yaml(data)
+    for player in meta['players'].values():
+        player.setdefault('will', '')
+
+    hot = {'wills': wills}
+    if row is not None:
+        hot['schedule'] = codec.load_yaml(row[0])
+    return apply_hot_meta(meta, hot)
+
+
+def read_meta(root):
+    """Read the meta of the game at ``root``, however it is stored, without
+    writing anything. This is safe to do while a server has the game open.
+    """
+    db_path = os.path.join(root, DB_NAME)
+    if not os.path.exists(db_path):
+        return load_meta_files(root)
+
+    db = sqlite3.connect('file:{}?mode=ro'.format(
+        urllib.parse.quote(os.path.abspath(db_path))), uri=True)
+    try:
+        return load_meta_db(db)
+    finally:
+        db.close()
+
+
+STORAGES = {
+    'files': FileStorage,
+    'sqlite': SQLiteStorage,
+}
+
+
+def open_storage(root, name=None):
+    """Open the storage of the game at ``root``.
+
+    Without a ``name``, a game with a database uses it, and any other game
+    uses files. Opening a game kept in files as ``sqlite`` moves it into a
+    database.
+    """
+    if name is None:
+        name = 'sqlite' if os.path.exists(os.path.join(root, DB_NAME)) \
+               else 'files'
+
+    try:
+        storage = STORAGES[name]
+    except KeyError:
+        raise ValueError('unknown storage: {}'.format(name))
+    return storage(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('game_path')
+    parser.add_argument('directory', nargs='?')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'import':
+        open_storage(args.game_path, 'sqlite').close()
+        return
+
+    storage = open_storage(args.game_path)
+    try:
+        storage.export(args.directory or args.game_path)
+    finally:
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""Print the moderator's and players' tokens for a game.
+
+Tokens are derived from the game's secret, so this does not need the server
+or glue::
+
+    python -m padrino.tokens <game path>
+
+Tokens are made here rather than in ``padrino.game``, which imports glue and
+so needs COSANOSTRA_GLUE_BIN_DIR set.
+"""
+
+import argparse
+import jwt
+
+from padrino import storage
+
+
+def encode_token(secret, id):
+    return jwt.encode({'t': id}, secret, algorithm='HS256').decode('utf-8')
+
+
+def make_poke_token(secret):
+    return jwt.encode({'p': True}, secret, algorithm='HS256').decode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('game_path')
+    args = parser.parse_args()
+
+    meta = storage.read_meta(args.game_path)
+
+    print('%10s: %s' % ('(poke)', make_poke_token(meta['secret'])))
+    for player_id, player in meta['players'].items():
+        print('%10s: %s' % (player['name'],
+                            encode_token(meta['secret'], player_id)))
+
+
+if __name__ == '__main__':
+    main()
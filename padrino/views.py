@@ -0,0 +1,56 @@
+import collections
+import threading
+
+
+class ViewCache(object):
+    """A bounded LRU cache of views computed from a game.
+
+    Only views that never change, such as those over finished phases, belong
+    here. Entries can still be dropped with ``invalidate`` when something
+    better becomes available.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, f):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = f()
+
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries)
+            }
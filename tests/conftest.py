@@ -0,0 +1,120 @@
+import os
+import sys
+
+import pytest
+
+from padrino import codec
+
+# padrino.glue reads this on import; tests that run glue point it at their
+# own fake binaries.
+os.environ.setdefault('COSANOSTRA_GLUE_BIN_DIR', os.devnull)
+
+# Stand-ins for the glue programs a game runs, just enough to get through
+# phases with two players and no actions. Any program named in
+# FAKE_GLUE_FAIL fails instead.
+FAKE_GLUE = '''\
+#!{python}
+import os
+import sys
+import yaml
+
+prog = {prog!r}
+args = sys.argv[1:]
+
+if prog in os.environ.get('FAKE_GLUE_FAIL', '').split(','):
+    sys.exit('{{}} failed'.format(prog))
+
+players = {{player_id: {{'causeOfDeath': None, 'faction': 0, 'friends': [],
+                          'cohorts': [], 'vanillaized': False}}
+            for player_id in (0, 1)}}
+
+if prog in ('run-night', 'run-day'):
+    with open(args[0]) as f:
+        state = yaml.safe_load(f)
+    if state['phase'] == 'Night':
+        state['phase'] = 'Day'
+    else:
+        state['phase'] = 'Night'
+        state['turn'] += 1
+    with open(args[0], 'w') as f:
+        yaml.safe_dump(state, f)
+    result = None
+elif prog == 'view-action-groups':
+    with open(args[1], 'w') as f:
+        yaml.safe_dump({{}}, f)
+    result = None
+elif prog == 'view-players':
+    result = players
+elif prog == 'view-history':
+    with open(args[0]) as f:
+        state = yaml.safe_load(f)
+    result = {{turn: {{'Night': [], 'Day': []}}
+              for turn in range(1, state['turn'] + 1)}}
+elif prog in ('view-plan',):
+    result = []
+elif prog in ('view-deaths', 'view-messages'):
+    result = {{}}
+else:
+    result = None
+
+yaml.safe_dump(result, sys.stdout)
+'''
+
+FAKE_GLUE_PROGS = [
+    'run-night', 'run-day', 'view-action-groups', 'view-players',
+    'view-winners', 'view-history', 'view-plan', 'view-deaths',
+    'view-messages',
+]
+
+STATE = {
+    'phase': 'Night',
+    'turn': 1,
+    'consensus': 'MostVotes',
+    'factions': {0: {'isPrimary': True}},
+}
+
+META = {
+    'name': 'Test',
+    'motd': '',
+    'locale': 'en-US',
+    'end_on_consensus_met': False,
+    'secret': 'secret',
+    'schedule': {
+        'night_end': '09:00:00',
+        'day_end': '21:00:00',
+        'twilight_duration': 60,
+        'phase_end': None,
+        'tz': 'UTC',
+    },
+    'actions': {},
+    'factions': {0: {'name': 'Town', 'translations': {}}},
+    'players': {
+        0: {'name': 'Alice', 'role': 'Townie', 'will': '', 'abilities': [],
+            'agenda': ''},
+        1: {'name': 'Bob', 'role': 'Townie', 'will': '', 'abilities': [],
+            'agenda': ''},
+    },
+}
+
+
+@pytest.fixture
+def fake_glue(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for prog in FAKE_GLUE_PROGS:
+        path = bin_dir / prog
+        path.write_text(FAKE_GLUE.format(python=sys.executable, prog=prog))
+        path.chmod(0o755)
+    monkeypatch.setenv('COSANOSTRA_GLUE_BIN_DIR', str(bin_dir))
+    return bin_dir
+
+
+@pytest.fixture
+def game_path(tmp_path, fake_glue):
+    path = tmp_path / 'game'
+    path.mkdir()
+    with open(str(path / 'state.yml'), 'w') as f:
+        codec.dump_yaml(STATE, f)
+    with open(str(path / 'meta.yml'), 'w') as f:
+        codec.dump_yaml(META, f)
+    return str(path)
@@ -0,0 +1,96 @@
+import pytest
+
+from padrino import admission
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission, 'time', clock)
+    return clock
+
+
+def test_bucket_allows_bursts_then_refills(clock):
+    bucket = admission.TokenBucket(2, 3)
+
+    for _ in range(3):
+        assert bucket.wait(clock.now) == 0
+        bucket.take()
+    assert bucket.wait(clock.now) == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.wait(clock.now) == 0
+
+    # Tokens never pile up past the burst.
+    clock.now += 100
+    bucket.wait(clock.now)
+    assert bucket.tokens == 3
+
+
+def test_admit_rate_limits_without_taking_tokens(clock):
+    limits = admission.Admission(rate=1, burst=1, player_rate=10,
+                                 player_burst=10)
+    bucket = limits.make_bucket()
+    player_bucket = limits.make_player_bucket()
+
+    assert limits.admit(bucket, player_bucket) is None
+    limits.done(0, 0.01)
+
+    assert limits.admit(bucket, player_bucket) == pytest.approx(1)
+    assert limits.rate_limited == 1
+    # The player's bucket was not drawn on for the rejected change.
+    assert player_bucket.tokens == pytest.approx(9)
+
+
+def test_unlimited_rates_make_no_buckets():
+    limits = admission.Admission()
+    assert limits.make_bucket() is None
+    assert limits.make_player_bucket() is None
+    assert limits.admit(None, None) is None
+
+
+def test_admit_sheds_over_max_pending(clock):
+    limits = admission.Admission(max_pending=2)
+
+    assert limits.admit() is None
+    assert limits.admit() is None
+
+    retry = limits.admit()
+    assert retry is not None
+    assert admission.MIN_RETRY <= retry <= admission.MAX_RETRY
+    assert limits.shed == 1
+    assert limits.pending == 2
+
+    limits.done(0, 0.5)
+    assert limits.admit() is None
+
+
+def test_shed_retry_follows_run_time(clock):
+    limits = admission.Admission(max_pending=1)
+
+    assert limits.admit() is None
+    limits.done(0, 2.0)
+    assert limits.admit() is None
+
+    # One change waiting, which should take about as long as the last.
+    assert limits.admit() == pytest.approx(2.0)
+
+
+def test_report_only_when_something_happened(clock):
+    limits = admission.Admission()
+    assert limits.report() is None
+
+    limits.admit()
+    limits.done(0.1, 0.2)
+    stats = limits.report()
+    assert stats['admitted'] == 1
+    assert stats['meanWaitMs'] == pytest.approx(100)
+    assert limits.report() is None
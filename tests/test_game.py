@@ -0,0 +1,57 @@
+import os
+
+from padrino import game
+
+
+def test_failed_log_update_does_not_fail_phase_end(game_path, monkeypatch):
+    g = game.Game(game_path)
+    try:
+        g.start()
+
+        monkeypatch.setenv('FAKE_GLUE_FAIL', 'view-history')
+        g.finish_phase()
+
+        assert g.state['phase'] == 'Day'
+        # Snapshot files were still pruned.
+        assert not os.path.exists(os.path.join(game_path, 'plan.yml.night.1'))
+
+        monkeypatch.delenv('FAKE_GLUE_FAIL')
+        assert list(g.get_game_log()) == [1]
+    finally:
+        g.storage.close()
+
+
+def test_snapshot_views_are_cached_without_files(game_path, monkeypatch):
+    g = game.Game(game_path)
+    try:
+        g.start()
+        g.finish_phase()
+
+        assert g.get_raw_plan_view(1, 'night') == []
+        g.prune_snapshot_files()
+
+        # A hit neither writes the snapshots out again nor runs glue.
+        monkeypatch.setenv('FAKE_GLUE_FAIL', 'view-plan')
+        assert g.get_raw_plan_view(1, 'night') == []
+        assert not os.path.exists(os.path.join(game_path, 'plan.yml.night.1'))
+    finally:
+        g.storage.close()
+
+
+def test_stored_log_entries_keep_int_keys(game_path):
+    g = game.Game(game_path)
+    try:
+        final_plan = [{
+            'command': 'Kill $0',
+            'source': 'Alice',
+            'targets': ['Bob'],
+            'trace': {'ActFromPlan': {'planGroup': 3}},
+        }]
+        entry = {
+            'planned': final_plan,
+            'log': g.build_phase_log(final_plan, []),
+        }
+        assert list(entry['log']) == [3]
+        assert game.LOG_FORMAT.loads(game.LOG_FORMAT.dumps(entry)) == entry
+    finally:
+        g.storage.close()
@@ -0,0 +1,80 @@
+import sys
+
+import pytest
+
+from padrino import glue
+
+# A stand-in for the glue worker, speaking framed JSON. ``echo`` answers with
+# its arguments and ``big`` with more output than the tests allow.
+FAKE_WORKER = '''\
+#!{python}
+import json
+import struct
+import sys
+
+header = struct.Struct('>I')
+
+while True:
+    raw = sys.stdin.buffer.read(header.size)
+    if len(raw) < header.size:
+        break
+    n, = header.unpack(raw)
+    request = json.loads(sys.stdin.buffer.read(n))
+    if request['prog'] == 'big':
+        response = {{'result': 'x' * 1024 * 1024}}
+    elif request['prog'] == 'fail':
+        response = {{'error': 'failed'}}
+    else:
+        response = {{'result': request['args']}}
+    out = json.dumps(response).encode('utf-8')
+    sys.stdout.buffer.write(header.pack(len(out)) + out)
+    sys.stdout.buffer.flush()
+'''
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    path = tmp_path / glue.COSANOSTRA_GLUE_WORKER
+    path.write_text(FAKE_WORKER.format(python=sys.executable))
+    path.chmod(0o755)
+    monkeypatch.setenv('COSANOSTRA_GLUE_BIN_DIR', str(tmp_path))
+
+    pool = glue.Pool(1, 'json')
+    yield pool
+    pool.close()
+
+
+def get_worker(pool):
+    worker = pool.slots.get()
+    pool.slots.put(worker)
+    return worker
+
+
+def test_pool_reuses_worker(pool):
+    assert pool.run('echo', 'a') == ['a']
+    worker = get_worker(pool)
+    assert pool.run('echo', 'b') == ['b']
+    assert get_worker(pool) is worker
+
+
+def test_pool_keeps_worker_after_glue_error(pool):
+    pool.run('echo')
+    worker = get_worker(pool)
+    with pytest.raises(glue.GlueError):
+        pool.run('fail')
+    assert get_worker(pool) is worker
+
+
+def test_pool_replaces_worker_after_oversize_output(pool):
+    pool.run('echo')
+    worker = get_worker(pool)
+
+    with pytest.raises(glue.OutputTooLarge):
+        pool.run('big', max_output=1024)
+
+    # The worker was reaped and its slot emptied...
+    assert worker.proc.returncode is not None
+    assert get_worker(pool) is None
+
+    # ...so the next call gets a fresh one.
+    assert pool.run('echo', 'a') == ['a']
@@ -0,0 +1,89 @@
+import copy
+
+import pytest
+
+from padrino import patch
+
+
+def unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def apply_patch(doc, ops):
+    """Apply the operations make_patch produces, as the web client does."""
+    doc = copy.deepcopy(doc)
+    for op in ops:
+        if op['path'] == '':
+            assert op['op'] == 'replace'
+            doc = copy.deepcopy(op['value'])
+            continue
+
+        *parents, last = [unescape(token)
+                          for token in op['path'].split('/')[1:]]
+        target = doc
+        for token in parents:
+            target = target[int(token) if isinstance(target, list) else token]
+
+        if isinstance(target, list):
+            if op['op'] == 'add':
+                assert last == '-'
+                target.append(copy.deepcopy(op['value']))
+            elif op['op'] == 'remove':
+                assert int(last) == len(target) - 1
+                target.pop()
+            else:
+                target[int(last)] = copy.deepcopy(op['value'])
+        elif op['op'] == 'remove':
+            del target[last]
+        else:
+            target[last] = copy.deepcopy(op['value'])
+    return doc
+
+
+CASES = [
+    ({}, {}),
+    ({'a': 1}, {'a': 2}),
+    ({'a': 1, 'b': 2}, {'b': 2, 'c': 3}),
+    ({'deaths': []}, {'deaths': [{'name': 'Alice'}]}),
+    ({'deaths': [1, 2, 3]}, {'deaths': [1]}),
+    ({'deaths': [1, 2]}, {'deaths': [3, 2, 1]}),
+    ({'a/b': {'~c': 1}}, {'a/b': {'~c': 2}}),
+    ({'plan': [{'targets': None}]}, {'plan': [{'targets': ['Bob']}]}),
+    ({'x': 1}, {'x': 1.0}),
+    ({'x': True}, {'x': 1}),
+    ({'x': {'y': 1}}, {'x': [1]}),
+    ([1, 2], {'a': 1}),
+]
+
+
+@pytest.mark.parametrize('old,new', CASES)
+def test_round_trip(old, new):
+    ops = patch.make_patch(old, new)
+    result = apply_patch(old, ops)
+    assert result == new
+    assert [type(v) for v in _leaves(result)] == \
+        [type(v) for v in _leaves(new)]
+
+
+def _leaves(doc):
+    if isinstance(doc, dict):
+        for key in sorted(doc):
+            yield from _leaves(doc[key])
+    elif isinstance(doc, list):
+        for value in doc:
+            yield from _leaves(value)
+    else:
+        yield doc
+
+
+def test_identical_documents_make_no_ops():
+    doc = {'a': [1, {'b': 2}]}
+    assert patch.make_patch(doc, doc) == []
+    assert patch.make_patch(doc, copy.deepcopy(doc)) == []
+
+
+def test_lists_are_shrunk_from_the_end():
+    assert patch.make_patch([1, 2, 3], [1]) == [
+        {'op': 'remove', 'path': '/2'},
+        {'op': 'remove', 'path': '/1'},
+    ]
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+
+import pytest
+import tornado.httpclient
+import tornado.httpserver
+import tornado.options
+import tornado.testing
+
+from padrino import admission
+from padrino import codec
+from padrino import server
+
+
+class FakeConnection(server.PlayerConnection):
+    def __init__(self, me_id, root):
+        self.init_connection()
+        self.me_id = me_id
+        self.root = root
+        self.frames = []
+
+    def write_message(self, message):
+        self.frames.append(message)
+
+
+def make_tabs(n):
+    root = {'publicState': {}, 'playerState': {}, 'phaseState': {},
+            'will': ''}
+    return [FakeConnection(1, root) for _ in range(n)]
+
+
+def fetch(make_app, path):
+    async def run():
+        sock, port = tornado.testing.bind_unused_port()
+        http_server = tornado.httpserver.HTTPServer(make_app())
+        http_server.add_sockets([sock])
+        try:
+            return await tornado.httpclient.AsyncHTTPClient().fetch(
+                'http://127.0.0.1:{}{}'.format(port, path), raise_error=False)
+        finally:
+            http_server.stop()
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def relay_app(tmp_path, monkeypatch):
+    """Make the app of a relay process, which serves pages without loading
+    games."""
+    def make_app(game_path=None, games_path=None):
+        monkeypatch.setattr(tornado.options.options, 'games_path', games_path)
+        return lambda: server.make_app(server.Relay(
+            str(tmp_path / 'bus.sock'), game_path, games_path))
+    return make_app
+
+
+def test_main_page_of_single_game(relay_app, tmp_path):
+    make_app = relay_app(game_path=str(tmp_path))
+    assert fetch(make_app, '/').code == 200
+
+
+def test_main_page_of_many_games(relay_app, tmp_path):
+    os.makedirs(str(tmp_path / 'one'))
+    (tmp_path / 'one' / 'meta.yml').write_text('{}')
+
+    make_app = relay_app(games_path=str(tmp_path))
+    assert fetch(make_app, '/g/one/').code == 200
+    assert fetch(make_app, '/g/two/').code == 404
+
+
+def test_phase_end_keeps_tabs_sharing_a_root():
+    tabs = make_tabs(2)
+
+    broadcast = server.Broadcast()
+    phase_end = {'publicState': {'turn': 2}, 'playerState': {},
+                 'phaseState': {'phase': 'Day'}, 'phase': 'Night',
+                 'result': {}}
+    for tab in tabs:
+        tab.send_phase_end(phase_end, broadcast)
+
+    assert tabs[0].root is tabs[1].root
+    assert tabs[0].frames[0] is tabs[1].frames[0]
+    assert broadcast.frames == 1
+
+    # So the next patch is only made and encoded once too.
+    broadcast = server.Broadcast()
+    update = {'phaseState': {'phase': 'Day', 'ballot': {}}}
+    for tab in tabs:
+        tab.send_update(update, broadcast)
+
+    assert tabs[0].root is tabs[1].root
+    assert tabs[0].version == tabs[1].version == 2
+    assert broadcast.frames == 1
+    assert broadcast.writes == 2
+
+
+def test_scheduler_replaces_superseded_deadline():
+    async def run():
+        fired = []
+        scheduler = server.Scheduler(lambda key: fired.append(
+            (key, time.monotonic())))
+
+        start = time.monotonic()
+        scheduler.schedule('a', time.time() + 0.05)
+        scheduler.schedule('a', time.time() + 0.2)
+        scheduler.schedule('b', time.time() + 0.1)
+        scheduler.schedule('c', time.time() + 0.05)
+        scheduler.unschedule('c')
+
+        await asyncio.sleep(0.4)
+        return start, fired
+
+    start, fired = asyncio.run(run())
+
+    assert [key for key, _ in fired] == ['b', 'a']
+    assert fired[1][1] - start >= 0.19
+
+
+def test_discover_skips_finished_games(tmp_path):
+    for game_id, game_over in [('live', False), ('done', True)]:
+        os.makedirs(str(tmp_path / game_id))
+        with open(str(tmp_path / game_id / 'meta.yml'), 'w') as f:
+            codec.dump_yaml({'players': {}, 'schedule': {
+                'phase_end': 1000, 'game_over': game_over}}, f)
+
+    async def run():
+        hosts = server.Hosts(games_path=str(tmp_path), idle_timeout=600,
+                             admission=admission.Admission())
+        hosts.discover()
+        return set(hosts.scheduler.current)
+
+    assert asyncio.run(run()) == {'live'}
+
+
+def test_resync_is_rate_limited():
+    connection = make_tabs(1)[0]
+    connection.admission = admission.Admission(rate=1, burst=1)
+    connection.bucket = connection.admission.make_bucket()
+    connection.bucket.take()
+
+    asyncio.run(connection.handle_message(
+        '{"type": "resync", "body": null, "seqNum": 7}'))
+
+    message, = connection.frames
+    assert message['type'] == 'rej'
+    assert message['body'] == 7
+    assert message['retry'] > 0
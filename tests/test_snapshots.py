@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from padrino import snapshots
+
+
+def make_states(n):
+    return [('turn: {}\nplayers: {}\n'.format(
+        turn, list(range(100)))).encode('utf-8') for turn in range(n)]
+
+
+def test_put_and_get_across_chains(tmp_path):
+    states = make_states(snapshots.MAX_CHAIN * 2 + 1)
+
+    store = snapshots.SnapshotStore(str(tmp_path))
+    for turn, state in enumerate(states):
+        store.put('state', 'night', turn, state)
+    store.close()
+
+    store = snapshots.SnapshotStore(str(tmp_path))
+    try:
+        for turn, state in enumerate(states):
+            assert store.get('state', 'night', turn) == state
+        assert ('state', 'night', 0) in store
+        assert ('state', 'day', 0) not in store
+    finally:
+        store.close()
+
+
+def test_put_refuses_to_replace(tmp_path):
+    store = snapshots.SnapshotStore(str(tmp_path))
+    try:
+        store.put('state', 'night', 1, b'a')
+        with pytest.raises(ValueError):
+            store.put('state', 'night', 1, b'b')
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize('cut', [1, 5, 12])
+def test_torn_write_is_dropped(tmp_path, cut):
+    states = make_states(3)
+
+    store = snapshots.SnapshotStore(str(tmp_path))
+    for turn, state in enumerate(states[:2]):
+        store.put('state', 'night', turn, state)
+    good_size = os.path.getsize(store.pack_path)
+    store.put('state', 'night', 2, states[2])
+    store.close()
+
+    # Lose the end of the last record, as a crash mid-append would.
+    pack_path = os.path.join(str(tmp_path), 'snapshots.pack')
+    with open(pack_path, 'r+b') as f:
+        f.truncate(good_size + cut)
+
+    store = snapshots.SnapshotStore(str(tmp_path))
+    try:
+        assert os.path.getsize(pack_path) == good_size
+        assert ('state', 'night', 2) not in store
+        assert store.get('state', 'night', 1) == states[1]
+
+        # The pack can be appended to again.
+        store.put('state', 'night', 2, states[2])
+    finally:
+        store.close()
+
+    store = snapshots.SnapshotStore(str(tmp_path))
+    try:
+        assert store.get('state', 'night', 2) == states[2]
+    finally:
+        store.close()
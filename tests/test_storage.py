@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+from padrino import codec
+from padrino import storage
+
+META = {
+    'name': 'Test',
+    'secret': 'secret',
+    'schedule': {'phase_end': None, 'tz': 'UTC'},
+    'players': {
+        0: {'name': 'Alice', 'will': ''},
+        1: {'name': 'Bob', 'will': ''},
+    },
+}
+
+
+@pytest.fixture(params=['files', 'sqlite'])
+def open_game(request, tmp_path):
+    with open(os.path.join(tmp_path, 'meta.yml'), 'w') as f:
+        codec.dump_yaml(META, f)
+
+    opened = []
+
+    def open_game():
+        games = storage.open_storage(str(tmp_path), request.param)
+        opened.append(games)
+        return games
+
+    yield open_game
+    for games in opened:
+        games.close()
+
+
+def test_meta_round_trip(open_game):
+    games = open_game()
+    meta = games.load_meta()
+    meta['players'][1]['will'] = 'Avenge me.'
+    meta['schedule']['phase_end'] = 1234
+    games.write_meta(games.dump_meta(meta))
+    games.close()
+
+    meta = open_game().load_meta()
+    assert meta['players'][0]['will'] == ''
+    assert meta['players'][1]['will'] == 'Avenge me.'
+    assert meta['schedule']['phase_end'] == 1234
+
+
+def test_will_change_appends_only_the_will(tmp_path):
+    with open(os.path.join(tmp_path, 'meta.yml'), 'w') as f:
+        codec.dump_yaml(META, f)
+
+    games = storage.FileStorage(str(tmp_path))
+    try:
+        meta = games.load_meta()
+        meta['players'][1]['will'] = 'Avenge me.'
+        games.write_meta(games.dump_meta(meta))
+    finally:
+        games.close()
+
+    with open(os.path.join(tmp_path, 'meta.hot.log')) as f:
+        assert f.read() == '{"will": [1, "Avenge me."]}\n'
+
+
+def test_torn_hot_log_write_is_dropped(tmp_path):
+    with open(os.path.join(tmp_path, 'meta.yml'), 'w') as f:
+        codec.dump_yaml(META, f)
+    with open(os.path.join(tmp_path, 'meta.hot.log'), 'w') as f:
+        f.write('{"will": [0, "first"]}\n{"will": [1, "sec')
+
+    games = storage.FileStorage(str(tmp_path))
+    try:
+        meta = games.load_meta()
+        assert meta['players'][0]['will'] == 'first'
+        assert meta['players'][1]['will'] == ''
+
+        # Later changes are not lost behind the torn line.
+        meta['players'][1]['will'] = 'second'
+        games.write_meta(games.dump_meta(meta))
+        assert storage.load_meta_files(str(tmp_path))['players'][1]['will'] \
+            == 'second'
+    finally:
+        games.close()
+
+
+def test_hot_log_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'MAX_HOT_LOG', 100)
+    with open(os.path.join(tmp_path, 'meta.yml'), 'w') as f:
+        codec.dump_yaml(META, f)
+
+    games = storage.FileStorage(str(tmp_path))
+    try:
+        meta = games.load_meta()
+        for i in range(10):
+            meta['players'][0]['will'] = 'will {}'.format(i)
+            games.write_meta(games.dump_meta(meta))
+    finally:
+        games.close()
+
+    log_path = os.path.join(tmp_path, 'meta.hot.log')
+    assert not os.path.exists(log_path) or os.path.getsize(log_path) <= 100
+    assert os.path.exists(os.path.join(tmp_path, 'meta.hot.yml'))
+    assert storage.load_meta_files(str(tmp_path))['players'][0]['will'] == \
+        'will 9'
+
+
+def test_read_meta_writes_nothing(open_game, tmp_path):
+    games = open_game()
+    meta = games.load_meta()
+    meta['players'][1]['will'] = 'Avenge me.'
+    games.write_meta(games.dump_meta(meta))
+
+    # The game is still open, and a write is torn.
+    log_path = os.path.join(tmp_path, 'meta.hot.log')
+    if os.path.exists(log_path):
+        with open(log_path, 'a') as f:
+            f.write('{"will": [0, "to')
+    before = {name: os.path.getsize(os.path.join(tmp_path, name))
+              for name in os.listdir(tmp_path)}
+
+    meta = storage.read_meta(str(tmp_path))
+    assert meta['players'][1]['will'] == 'Avenge me.'
+    assert meta['players'][0]['will'] == ''
+    assert {name: os.path.getsize(os.path.join(tmp_path, name))
+            for name in os.listdir(tmp_path)} == before